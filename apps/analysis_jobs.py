@@ -0,0 +1,260 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-11
+"""
+异步的大纲分析任务：提交之后立即返回任务ID，任务在模型服务中排队处理，
+可以随时查询任务的状态、每个阶段（base / story / role / other）的用时，以及结束之后的标签和词云
+"""
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, Tuple
+
+from novela import logger
+import novela.constants as constants
+from apps.outline_funcs import OUTLINE_STAGES, save_as_excel
+from apps.model_server import ModelServer
+
+
+logger = logger.getChild("analysis-jobs")
+
+
+# 任务的状态
+JOB_PENDING = "pending"        # 在队列中等待
+JOB_RUNNING = "running"        # 正在模型服务中处理
+JOB_SAVING = "saving"          # 正在保存Excel文件
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_FINISHED_STATUS = (JOB_DONE, JOB_FAILED)
+
+
+class JobQueueFullError(RuntimeError):
+    """任务队列已满"""
+
+
+class ModelServerNotReadyError(RuntimeError):
+    """还没有初始化模型服务"""
+
+
+class AnalysisJob:
+    def __init__(self, source_file: str, target_file: str):
+        """
+        一个大纲文件的分析任务
+        :param source_file: str型，大纲文件的路径
+        :param target_file: str型，保存标签的Excel文件的路径
+        """
+        self.job_id = uuid.uuid4().hex
+        self.source_file = source_file
+        self.target_file = target_file
+        self.status = JOB_PENDING
+        self.stage_times: Dict[str, float] = {}
+        self.novel_name = None
+        self.labels = None
+        self.wordcloud = None
+        self.error = None
+        self.submit_time = time.time()
+        self.start_time = None
+        self.finish_time = None
+        # 每次状态变化时加1，推送进度时据此判断是否有新的状态
+        self.version = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in JOB_FINISHED_STATUS
+
+    def to_json(self) -> Dict[str, Any]:
+        """任务当前的状态，结束之后包括标签和base64编码的词云图片"""
+        now = self.finish_time or time.time()
+        completed = [stage for stage in OUTLINE_STAGES if stage in self.stage_times]
+        result = OrderedDict()
+        result["job_id"] = self.job_id
+        result["status"] = self.status
+        result["stages"] = list(OUTLINE_STAGES)
+        result["completed_stages"] = completed
+        result["stage_times"] = {stage: self.stage_times[stage] for stage in completed}
+        result["queued_time"] = (self.start_time or now) - self.submit_time
+        result["elapsed_time"] = now - self.start_time if self.start_time is not None else 0.0
+        if self.status == JOB_DONE:
+            result["novel_name"] = self.novel_name
+            result["labels"] = self.labels
+            result["wordcloud"] = self.wordcloud
+        elif self.status == JOB_FAILED:
+            result["error"] = self.error
+        return result
+
+
+class AnalysisJobManager:
+    def __init__(self,
+                 model_server: Optional[ModelServer] = None,
+                 max_queue_size: int = constants.ANALYSIS_QUEUE_SIZE,
+                 max_history: int = constants.ANALYSIS_JOB_HISTORY):
+        """
+        分析任务的管理：有界的任务队列，并限制同时提交给模型服务的任务数量（即模型服务的进程数量）
+        :param model_server: ModelServer型（可选），处理任务的模型服务，可以之后通过set_model_server设置
+        :param max_queue_size: int型，等待中和正在处理的任务总数的上限，超过之后提交任务抛出JobQueueFullError
+        :param max_history: int型，最多保留的已经结束的任务数量
+        """
+        self.model_server = model_server
+        self.max_queue_size = max_queue_size
+        self.max_history = max_history
+        self._jobs: "OrderedDict[str, AnalysisJob]" = OrderedDict()
+        self._pending = deque()
+        self._num_running = 0
+        # 保护所有任务的状态，状态变化时通知等待的线程
+        self._cond = threading.Condition()
+        # 保存结果（转化标签并写入Excel文件）比较耗时，由单独的写入线程依次完成，
+        # 不占用进程池中接收结果的线程，写入线程在第一次有结果时才启动
+        self._write_queue: "queue.Queue[Optional[Tuple[AnalysisJob, Dict[str, Any]]]]" = queue.Queue()
+        self._writer_thread: Optional[threading.Thread] = None
+
+    @property
+    def max_concurrency(self) -> int:
+        """同时处理的任务数量，与当前模型服务的进程数量一致，没有模型服务时为0"""
+        return self.model_server.num_workers if self.model_server is not None else 0
+
+    def set_model_server(self, model_server: ModelServer) -> Optional[ModelServer]:
+        """
+        更换模型服务，之后的任务提交给新的模型服务
+        :return: 原来的模型服务（可能为None），由调用者负责关闭，正在处理的任务仍然在原来的模型服务中完成
+        """
+        with self._cond:
+            old_server, self.model_server = self.model_server, model_server
+            self._dispatch()
+        return old_server
+
+    def submit(self, source_file: str, target_file: str) -> AnalysisJob:
+        """
+        提交一个分析任务，立即返回
+        :param source_file: str型，大纲文件的路径
+        :param target_file: str型，保存标签的Excel文件的路径
+        :return: AnalysisJob对象
+        :raises ModelServerNotReadyError: 还没有设置模型服务
+        :raises JobQueueFullError: 等待中和正在处理的任务数量已经达到上限
+        """
+        with self._cond:
+            if self.model_server is None:
+                raise ModelServerNotReadyError("The models have not been initialized, please call `/init` first.")
+            num_queued = len(self._pending) + self._num_running
+            if num_queued >= self.max_queue_size:
+                raise JobQueueFullError(f"The job queue is full ({num_queued} jobs), please try again later.")
+            job = AnalysisJob(source_file, target_file)
+            self._jobs[job.job_id] = job
+            self._pending.append(job)
+            logger.info(f"提交任务{job.job_id}：{source_file}")
+            self._dispatch()
+        return job
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def wait(self, job: AnalysisJob, version: int, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        等待任务的状态发生变化（job.version不等于version）或者超时
+        :return: Dict型，任务当前的状态（包括version字段），超时时返回的状态与之前相同
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: job.version != version, timeout=timeout)
+            result = job.to_json()
+            result["version"] = job.version
+            return result
+
+    def wait_finished(self, job: AnalysisJob, timeout: Optional[float] = None) -> AnalysisJob:
+        """等待任务结束（或者超时），返回任务对象"""
+        with self._cond:
+            self._cond.wait_for(lambda: job.finished, timeout=timeout)
+        return job
+
+    def _update(self, job: AnalysisJob, **kwargs):
+        """修改任务的属性并通知等待的线程，调用时需要持有self._cond"""
+        for key, value in kwargs.items():
+            setattr(job, key, value)
+        job.version += 1
+        self._cond.notify_all()
+
+    def _dispatch(self):
+        """将等待中的任务提交给模型服务，直到达到并发数量的上限，调用时需要持有self._cond"""
+        while self._pending and self._num_running < self.max_concurrency and self.model_server is not None:
+            job = self._pending.popleft()
+            self._num_running += 1
+            self._update(job, status=JOB_RUNNING, start_time=time.time())
+            try:
+                self.model_server.submit(job.source_file,
+                                         callback=lambda result, job=job: self._on_result(job, result),
+                                         error_callback=lambda e, job=job: self._on_error(job, e),
+                                         job_id=job.job_id,
+                                         progress_callback=lambda stage, seconds, job=job:
+                                         self._on_progress(job, stage, seconds))
+            except Exception as e:
+                # 例如模型服务已经关闭
+                self._num_running -= 1
+                self._finish(job, status=JOB_FAILED, error=f"{type(e).__name__}: {e}")
+
+    def _on_progress(self, job: AnalysisJob, stage: str, seconds: float):
+        with self._cond:
+            if job.status == JOB_RUNNING:
+                stage_times = dict(job.stage_times)
+                stage_times[stage] = seconds
+                self._update(job, stage_times=stage_times)
+
+    def _on_result(self, job: AnalysisJob, result: Dict[str, Any]):
+        """在进程池接收结果的线程中调用，只更新任务的状态并把结果交给写入线程"""
+        with self._cond:
+            self._num_running -= 1
+            self._dispatch()
+            self._update(job, status=JOB_SAVING, stage_times=result["stage_times"])
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._write_loop, name="analysis-jobs-writer",
+                                                       daemon=True)
+                self._writer_thread.start()
+        self._write_queue.put((job, result))
+
+    def _write_loop(self):
+        """依次保存每个任务的结果，同一时间只有一个线程写Excel文件"""
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                break
+            job, result = item
+            try:
+                logger.info(f"保存文件到{job.target_file}")
+                save_as_excel(to_file=job.target_file,
+                              novel_name=result["novel_name"],
+                              label=result["label"])
+                labels = result["label"].to_json()
+                logger.info(f"任务{job.job_id}完成！")
+            except Exception as e:
+                logger.warning(f"保存任务{job.job_id}的结果出错!@{e}")
+                with self._cond:
+                    self._finish(job, status=JOB_FAILED, error=f"{type(e).__name__}: {e}")
+                continue
+
+            with self._cond:
+                self._finish(job, status=JOB_DONE,
+                             novel_name=result["novel_name"],
+                             labels=labels,
+                             wordcloud=result["wordcloud"])
+
+    def close(self):
+        """保存完已经完成的任务的结果之后停止写入线程（不关闭模型服务）"""
+        with self._cond:
+            writer_thread, self._writer_thread = self._writer_thread, None
+        if writer_thread is not None:
+            self._write_queue.put(None)
+            writer_thread.join()
+
+    def _on_error(self, job: AnalysisJob, e: BaseException):
+        logger.warning(f"任务{job.job_id}出错!@{e}")
+        with self._cond:
+            self._num_running -= 1
+            self._dispatch()
+            self._finish(job, status=JOB_FAILED, error=f"{type(e).__name__}: {e}")
+
+    def _finish(self, job: AnalysisJob, **kwargs):
+        """结束任务，并删除超过保留数量的最早结束的任务，调用时需要持有self._cond"""
+        self._update(job, finish_time=time.time(), **kwargs)
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
@@ -2,15 +2,18 @@
 # @Author: 莫冉
 # @Date: 2021-02-26
 import os
-import base64
-import io
-from flask import Flask
-from flask import render_template, request
+import time
+import json
+import threading
+from typing import Dict, Any, Optional, Tuple
+from flask import Flask, Response
+from flask import render_template, request, stream_with_context
 from flask.views import View
 
-from apps.outline_funcs import *
+from apps.model_server import ModelServer
+from apps.analysis_jobs import AnalysisJobManager, AnalysisJob, JobQueueFullError, ModelServerNotReadyError
+from apps.analysis_jobs import JOB_DONE, JOB_FINISHED_STATUS
 from novela import logger
-from novela.utils.common import get_wordcloud
 import novela.constants as constants
 
 
@@ -25,11 +28,10 @@ app = Flask(__name__,
 
 class OutlineApp():
     def __init__(self):
-        self.sim_word2vector = None
-        self.sim_cilin = None
-        self.sim_hownet = None
-        self.sim_sent2vector = None
-        self.stopwords = set()
+        # 常驻的模型服务由任务管理对象持有，模型只在初始化时加载一次，每个请求只提交任务
+        self.job_manager = AnalysisJobManager()
+        # 同一时间只能有一个初始化请求
+        self._init_lock = threading.Lock()
 
     # @app.route('/')
     # @app.route('/index')
@@ -42,26 +44,20 @@ class OutlineApp():
         start_time = time.time()
         params = request.json
         word2vec_file = params.get("word2vec_file")
-        # 加载停用词
-        self.stopwords = load_stopwords(file=constants.STOPWORDS_FILE)
-        # --- 单词相似度部分 ---
-        logger.info("构造单词语义相似度计算对象")
-        self.sim_word2vector = WordVectorSimilarity(w2v_file=word2vec_file)
-        logger.info("构造词林相似度对象")
-        self.sim_cilin = CilinSimilarity(cilin_file=constants.CILIN_FILE)
-        logger.info("构造HowNet相似度计算对象")
-        self.sim_hownet = HowNetSimilarity(glossary_file=constants.GLOSSARY_FILE,
-                                      sememe_file=constants.WHOLE_DAT)
-        # --- 语句相似度部分 ---
-        logger.info("构造语句相似度计算对象")
-        self.sim_sent2vector = SentVectorSimilarity(stopwords=self.stopwords,
-                                               word2vec=self.sim_word2vector.word2vec)
+        num_workers = int(params.get("num_workers", constants.MODEL_SERVER_WORKERS))
+        with self._init_lock:
+            # 重新初始化时，新的任务交给新的模型服务，
+            # 原来的模型服务在后台处理完已经提交的任务之后关闭，不阻塞当前请求
+            model_server = ModelServer(w2v_file=word2vec_file, num_workers=num_workers)
+            old_server = self.job_manager.set_model_server(model_server)
+            if old_server is not None:
+                threading.Thread(target=old_server.close, name="model-server-close", daemon=True).start()
 
         logger.info(f"初始化共计用时 {time.time() - start_time} s.")
         return {"message": "初始化成功", "status_code": 1}
 
-    # @app.route('/analysis', methods=["POST"])
-    def analysis(self):
+    def _submit_job(self) -> AnalysisJob:
+        """根据请求的参数检查文件路径，并提交分析任务"""
         params = request.json
         source_path = params.get("source_path")
         source_file = params.get("source_file")
@@ -81,81 +77,73 @@ class OutlineApp():
             os.makedirs(target_path)
         target_file = os.path.join(target_path, target_file)
 
-        # 将文件中的数据转化为Dict型
-        logger.info(f"读取小说大纲文件{source_file}，并转化为Comic对象")
-        document_dict = read_document_to_dict(file=source_file)
-        novel_name = document_dict["小说名"]  # 小说的名称
-        # 转化为Comic对象
-        comic = Comic()
-        parse_document(document_dict, comic=comic)
-
-        # 获取整个story中的strings和words
-        story_sent_strings, story_sent_words, words_tfidf, *_ = get_story_words_and_sentences(comic,
-                                                                                              self.stopwords)
-        wordcloud_img = self.get_tfidf_wordcloud(sent_words=story_sent_words,
-                                                 words_tfidf=words_tfidf)
-
-        # 创建空的Label对象
-        label = Label()
-        start_time = time.time()
-        classify_base_info(comic=comic, label=label)
-        logger.info(f"得到基本信息的标签，共计用时 {(time.time() - start_time) * 1000} ms.")
-
-        start_time = time.time()
-        classify_story_info(comic=comic, label=label,
-                            stopwords=self.stopwords,
-                            sim_word2vector=self.sim_word2vector,
-                            sim_cilin=self.sim_cilin,
-                            sim_hownet=self.sim_hownet,
-                            sim_sent2vector=self.sim_sent2vector,
-                            sent_words=story_sent_words,
-                            sent_strings=story_sent_strings)
-        logger.info(f"得到故事信息的标签，共计用时 {(time.time() - start_time) * 1000} ms.")
-
-        start_time = time.time()
-        classify_role_info(comic=comic, label=label,
-                           stopwords=self.stopwords,
-                           sim_word2vector=self.sim_word2vector,
-                           sim_cilin=self.sim_cilin,
-                           sim_hownet=self.sim_hownet,
-                           sim_sent2vector=self.sim_sent2vector)
-        logger.info(f"得到角色信息的标签，共计用时 {(time.time() - start_time) * 1000} ms.")
-
-        start_time = time.time()
-        classify_other_info(comic=comic, label=label,
-                            stopwords=self.stopwords,
-                            sim_word2vector=self.sim_word2vector,
-                            sim_cilin=self.sim_cilin,
-                            sim_hownet=self.sim_hownet,
-                            sim_sent2vector=self.sim_sent2vector,
-                            sent_words=story_sent_words,
-                            sent_strings=story_sent_strings)
-        logger.info(f"得到其他信息的标签，共计用时 {(time.time() - start_time) * 1000} ms.")
-
-        logger.info(f"保存文件到{target_file}")
-        save_as_excel(to_file=target_file,
-                      novel_name=novel_name,
-                      label=label)
-        logger.info("保存完成！")
-
-        return wordcloud_img
-
-    def get_tfidf_wordcloud(self,
-                            sent_words: List[str],
-                            words_tfidf: List[float]):
-        wc = get_wordcloud(font_path=constants.FONT_FILE,
-                           width=800,
-                           height=400,
-                           max_font_size=300,
-                           max_words=80,
-                           background_color="white")
-        data = dict(zip(sent_words, words_tfidf))
-        pil_img = wc.generate_from_frequencies(data).to_image()
-        img = io.BytesIO()
-        pil_img.save(img, 'PNG')
-        img.seek(0)
-        img_base64 = base64.b64encode(img.getvalue()).decode()
-        return img_base64
-
-
+        return self.job_manager.submit(source_file, target_file)
+
+    def _try_submit_job(self) -> Tuple[Optional[AnalysisJob], Optional[Tuple[Dict[str, Any], int]]]:
+        """
+        提交分析任务，无法提交时不抛出异常，而是返回错误信息和HTTP状态码：
+        任务队列已满时为429，还没有初始化模型服务时为409
+        :return: Tuple型，(任务, None)或者(None, (错误信息, HTTP状态码))
+        """
+        try:
+            return self._submit_job(), None
+        except JobQueueFullError as e:
+            return None, ({"message": str(e), "status_code": 0}, 429)
+        except ModelServerNotReadyError as e:
+            return None, ({"message": str(e), "status_code": 0}, 409)
 
+    # @app.route('/analysis', methods=["POST"])
+    def analysis(self):
+        job, error = self._try_submit_job()
+        if error is not None:
+            return error
+        # 在模型服务的子进程中处理大纲，当前线程只等待任务结束
+        job = self.job_manager.wait_finished(job, timeout=constants.ANALYSIS_SYNC_TIMEOUT)
+        if not job.finished:
+            # 任务仍在处理，之后可以通过异步任务的接口查询结果
+            return {"message": f"The analysis of `source_file`: {job.source_file} did not finish in "
+                               f"{constants.ANALYSIS_SYNC_TIMEOUT}s, query `/analysis/jobs/{job.job_id}` "
+                               f"for the result.",
+                    "status_code": 0,
+                    "job_id": job.job_id}, 202
+        if job.status != JOB_DONE:
+            raise RuntimeError(f"Failed to analyze `source_file`: {job.source_file}. {job.error}")
+        return job.wordcloud
+
+    # @app.route('/analysis/jobs', methods=["POST"])
+    def submit_job(self):
+        job, error = self._try_submit_job()
+        if error is not None:
+            return error
+        return {"message": "提交成功", "status_code": 1, "job_id": job.job_id}, 202
+
+    # @app.route('/analysis/jobs/<job_id>', methods=["GET"])
+    def job_status(self, job_id: str):
+        """
+        查询任务的状态，结束之后同时返回标签和词云；
+        请求头包括`Accept: text/event-stream`或者参数中指定`stream=1`时，以SSE的方式推送每一次状态变化直到任务结束
+        """
+        job = self.job_manager.get(job_id)
+        if job is None:
+            return {"message": f"There is no job with `job_id`: {job_id}.", "status_code": 0}, 404
+
+        stream = request.args.get("stream", "0").lower() in ("1", "true") or \
+            request.accept_mimetypes.best == "text/event-stream"
+        if not stream:
+            return {"status_code": 1, **job.to_json()}
+        return Response(stream_with_context(self._stream_job(job)),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    def _stream_job(self, job: AnalysisJob):
+        version = -1
+        while True:
+            state = self.job_manager.wait(job, version, timeout=constants.ANALYSIS_STREAM_HEARTBEAT)
+            if state["version"] == version:
+                # 状态没有变化，发送注释行作为心跳
+                yield ": keep-alive\n\n"
+                continue
+            version = state.pop("version")
+            yield f"event: {state['status']}\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+            if state["status"] in JOB_FINISHED_STATUS:
+                break
@@ -0,0 +1,183 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-10
+"""
+常驻的模型服务：在当前机器上启动一个长期存在的进程池，所有的模型只加载一次并由子进程持有，
+Flask只负责提交任务并等待结果，多个/analysis请求可以并行处理，互不阻塞，也不需要重新加载模型
+"""
+import io
+import base64
+import threading
+import multiprocessing
+from multiprocessing.pool import AsyncResult
+from typing import Dict, Any, List, Optional, Callable
+
+from novela import logger
+import novela.constants as constants
+from novela.utils.common import get_wordcloud
+from apps.outline_funcs import OutlineModels, analyze_outline_file, freeze_gc, unfreeze_gc
+
+
+logger = logger.getChild("model-server")
+
+
+# 子进程中使用的模型：支持fork时在创建子进程之前由父进程加载，子进程以写时复制的方式共享；
+# 否则由每个子进程在启动时各自加载一次
+_SERVER_MODELS: Optional[OutlineModels] = None
+# 子进程向主进程报告处理进度的队列，元素为(job_id, 阶段名, 用时)
+_PROGRESS_QUEUE = None
+
+
+def _init_worker(w2v_file: Optional[str], progress_queue):
+    """子进程启动时设置进度队列，并加载模型（只有不支持fork的平台需要加载）"""
+    global _SERVER_MODELS, _PROGRESS_QUEUE
+    _PROGRESS_QUEUE = progress_queue
+    if _SERVER_MODELS is None:
+        _SERVER_MODELS = OutlineModels(w2v_file=w2v_file)
+
+
+def get_tfidf_wordcloud(sent_words: List[str], words_tfidf: List[float]) -> str:
+    """根据单词的tfidf值生成词云，返回base64编码的PNG图片"""
+    wc = get_wordcloud(font_path=constants.FONT_FILE,
+                       width=800,
+                       height=400,
+                       max_font_size=300,
+                       max_words=80,
+                       background_color="white")
+    data = dict(zip(sent_words, words_tfidf))
+    pil_img = wc.generate_from_frequencies(data).to_image()
+    img = io.BytesIO()
+    pil_img.save(img, 'PNG')
+    img.seek(0)
+    img_base64 = base64.b64encode(img.getvalue()).decode()
+    return img_base64
+
+
+def _analysis_task(source_file: str, job_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    在子进程中处理一个大纲文件，并生成词云
+    :param source_file: str型，大纲文件的路径
+    :param job_id: str型（可选），指定时每个阶段完成后通过进度队列报告给主进程
+    :return: Dict型，包括novel_name、label、wordcloud（base64编码的PNG图片）以及stage_times
+    """
+    progress_callback = None
+    if job_id is not None and _PROGRESS_QUEUE is not None:
+        def progress_callback(stage: str, seconds: float):
+            _PROGRESS_QUEUE.put((job_id, stage, seconds))
+    result = analyze_outline_file(source_file, _SERVER_MODELS, progress_callback=progress_callback)
+    words, tfidf = result.pop("words"), result.pop("tfidf")
+    result["wordcloud"] = get_tfidf_wordcloud(sent_words=words, words_tfidf=tfidf)
+    return result
+
+
+class ModelServer:
+    def __init__(self, w2v_file: str, num_workers: int = constants.MODEL_SERVER_WORKERS):
+        """
+        启动常驻的模型服务
+        :param w2v_file: str型，词向量文件（或者编译好的词向量目录）的路径
+        :param num_workers: int型，处理大纲的进程数量，也就是可以同时处理的请求数量
+        """
+        self.w2v_file = w2v_file
+        self.num_workers = num_workers
+
+        global _SERVER_MODELS
+        self._models = None
+        if "fork" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("fork")
+            # 模型在创建子进程之前只加载一次，所有子进程只读共享
+            self._models = _SERVER_MODELS = OutlineModels(w2v_file=w2v_file)
+            freeze_gc()
+        else:
+            logger.warning("当前平台不支持fork方式创建进程，每个子进程分别加载一次模型")
+            ctx = multiprocessing.get_context("spawn")
+        self._progress_queue = ctx.Queue()
+        # 进程池在构造时创建所有的子进程，之后才启动自己的管理线程；
+        # 当前服务的辅助线程（进度线程）也在所有子进程创建之后才启动
+        self._pool = ctx.Pool(processes=num_workers,
+                              initializer=_init_worker,
+                              initargs=(w2v_file, self._progress_queue))
+
+        # 在主进程中接收子进程报告的进度，并转交给提交任务时指定的progress_callback
+        self._progress_callbacks: Dict[str, Callable[[str, float], None]] = {}
+        self._progress_lock = threading.Lock()
+        self._progress_thread = threading.Thread(target=self._progress_loop, name="model-server-progress",
+                                                 daemon=True)
+        self._progress_thread.start()
+        logger.info(f"模型服务已经启动，共{num_workers}个进程")
+
+    def _progress_loop(self):
+        while True:
+            item = self._progress_queue.get()
+            if item is None:
+                break
+            job_id, stage, seconds = item
+            with self._progress_lock:
+                progress_callback = self._progress_callbacks.get(job_id)
+            if progress_callback is not None:
+                try:
+                    progress_callback(stage, seconds)
+                except Exception as e:
+                    logger.warning(f"处理任务{job_id}的进度出错!@{e}")
+
+    def submit(self,
+               source_file: str,
+               callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+               error_callback: Optional[Callable[[BaseException], None]] = None,
+               job_id: Optional[str] = None,
+               progress_callback: Optional[Callable[[str, float], None]] = None) -> AsyncResult:
+        """
+        提交一个大纲文件的处理任务，立即返回
+        :param source_file: str型，大纲文件的路径
+        :param callback: 可调用对象（可选），任务完成时在当前进程中以结果为参数调用
+        :param error_callback: 可调用对象（可选），任务出错时在当前进程中以异常为参数调用
+        :param job_id: str型（可选），任务的唯一标识，需要接收进度时指定
+        :param progress_callback: 可调用对象（可选），每个阶段完成时在当前进程中以阶段名和用时（s）为参数调用，
+                                  任务结束之后到达的进度不再转交
+        :return: AsyncResult对象，通过get()得到_analysis_task的结果
+        """
+        if job_id is not None and progress_callback is not None:
+            with self._progress_lock:
+                self._progress_callbacks[job_id] = progress_callback
+
+        def _forget_job():
+            if job_id is not None:
+                with self._progress_lock:
+                    self._progress_callbacks.pop(job_id, None)
+
+        def _on_result(result):
+            _forget_job()
+            if callback is not None:
+                callback(result)
+
+        def _on_error(e):
+            _forget_job()
+            if error_callback is not None:
+                error_callback(e)
+
+        return self._pool.apply_async(_analysis_task, (source_file, job_id),
+                                      callback=_on_result, error_callback=_on_error)
+
+    def analyze(self, source_file: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """提交任务并等待结果，子进程中的异常会在这里重新抛出"""
+        return self.submit(source_file).get(timeout=timeout)
+
+    def close(self):
+        """不再接收新的任务，等待正在处理的任务完成之后关闭所有子进程"""
+        global _SERVER_MODELS
+        self._pool.close()
+        self._pool.join()
+        self._progress_queue.put(None)
+        self._progress_thread.join()
+        if self._models is not None:
+            # 释放主进程中的模型（新的模型服务可能已经替换了全局的模型）
+            if _SERVER_MODELS is self._models:
+                _SERVER_MODELS = None
+            self._models = None
+            unfreeze_gc()
+        logger.info("模型服务已经关闭")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
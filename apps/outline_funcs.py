@@ -2,12 +2,16 @@
 # @Author: 莫冉
 # @Date: 2021-02-26
 import os
-import docx
+import gc
 import re
 import time
 import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
-from typing import Dict, Any, Set, Optional, List
+from typing import Dict, Any, Set, Optional, List, Tuple, Iterator, Callable
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 from novela import logger
@@ -15,9 +19,13 @@ import novela.constants as constants
 from novela.novel import Comic, Outline, StoryLine, Person
 from novela.label import Label, RoleInfo
 from novela.text import WordVectorSimilarity, CilinSimilarity, HowNetSimilarity, SentVectorSimilarity
+from novela.text import DocumentFeatures
 from novela.utils.common import clean_text, load_stopwords
+from novela.utils.docx_utils import read_docx
+from novela.utils.segment_cache import cached_cut
 from novela.utils.label_utils import cut_and_remove_stopwords, similarity_between_base_label_and_sents
-from novela.utils.label_utils import save_as_excel
+from novela.utils.label_utils import similarity_between_base_labels_and_sents
+from novela.utils.label_utils import save_as_excel, precompute_label_embeddings
 
 
 def read_document_to_dict(file: str) -> Dict[str, Any]:
@@ -29,7 +37,7 @@ def read_document_to_dict(file: str) -> Dict[str, Any]:
     else:
         novel_name = group[0]
     doc_dict = {"小说名": novel_name}  # 用来存储大纲中的内容
-    document = docx.Document(file)
+    document = read_docx(file)
 
     # 由于大纲是按照表格的形式存储的
     # 所以逐个读取
@@ -201,7 +209,7 @@ def get_story_words_and_sentences(comic: Comic, stopwords: Set[str]):
     获取故事中的有效单词和语句
     :param comic: Comic对象，表示存在的漫画类
     :param stopwords: Set[str]，表示停用词集合
-    :return:
+    :return: 语句、有效单词、有效单词的Tfidf值、Tfidf模型以及每个语句的分词结果
     """
     outline_sents_dict = comic.outline.get_sentences()
     outline_sents = []
@@ -217,7 +225,12 @@ def get_story_words_and_sentences(comic: Comic, stopwords: Set[str]):
     storyline_sents = comic.storyline.get_sentences()
 
     sent_strings = outline_sents + storyline_sents
-    sentences = [" ".join(cut_and_remove_stopwords(sent, stopwords)) for sent in sent_strings]
+    # 每个语句只分词一次，后续计算句向量时直接使用分词结果
+    sent_tokens = [cached_cut(sent) for sent in sent_strings]
+    if stopwords is not None:
+        sentences = [" ".join(word for word in tokens if word not in stopwords) for tokens in sent_tokens]
+    else:
+        sentences = [" ".join(tokens) for tokens in sent_tokens]
     # 定义并训练TFIDF模型
     # 设置token_pattern防止忽略长度为1的单词
     logger.info("训练Tfidf模型")
@@ -241,7 +254,16 @@ def get_story_words_and_sentences(comic: Comic, stopwords: Set[str]):
         valid_words.append(vocabulary[ind])
         valid_tfidf.append(sparse_value[0, ind])
 
-    return sent_strings, valid_words, valid_tfidf, tfidf_model
+    return sent_strings, valid_words, valid_tfidf, tfidf_model, sent_tokens
+
+
+def get_story_features(comic: Comic,
+                       stopwords: Set[str],
+                       sim_word2vector: WordVectorSimilarity,
+                       sim_sent2vector: SentVectorSimilarity) -> DocumentFeatures:
+    """获取整个故事的文档特征，故事信息和其他信息的分类共用"""
+    sent_strings, sent_words, _, _, sent_tokens = get_story_words_and_sentences(comic, stopwords)
+    return DocumentFeatures(sent_words, sent_strings, sim_word2vector, sim_sent2vector, sent_tokens=sent_tokens)
 
 
 def classify_story_info(comic: Comic,
@@ -252,123 +274,59 @@ def classify_story_info(comic: Comic,
                         sim_cilin: CilinSimilarity,
                         sim_sent2vector: SentVectorSimilarity,
                         sent_strings: Optional[List[str]] = None,
-                        sent_words: Optional[List[str]] = None):
+                        sent_words: Optional[List[str]] = None,
+                        features: Optional[DocumentFeatures] = None):
     """
     对故事信息中的一些标签进行分类
+    :param features: DocumentFeatures型（可选），故事的文档特征，为空时根据sent_words和sent_strings计算
     """
     # 首先获取故事信息中所有有效的单词和语句
-    if sent_words is None or sent_strings is None:
-        sent_strings, sent_words, *_ = get_story_words_and_sentences(comic, stopwords)
-
-    # 计算单词和标签之间的相似度
-    # --- 主要情节第一层和次要情节第一层 ---
-    storyplot_enum_names, storyplot_values = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                                     sent_strings=sent_strings,
-                                                                                     base_label=label.story_info.major_storyplot_first,
-                                                                                     sim_word2vector=sim_word2vector,
-                                                                                     sim_hownet=sim_hownet,
-                                                                                     sim_cilin=sim_cilin,
-                                                                                     sim_sent2vector=sim_sent2vector,
-                                                                                     return_counts=2)
+    if features is None:
+        if sent_words is None or sent_strings is None:
+            features = get_story_features(comic, stopwords, sim_word2vector, sim_sent2vector)
+        else:
+            features = DocumentFeatures(sent_words, sent_strings, sim_word2vector, sim_sent2vector)
+
+    # 计算单词和标签之间的相似度，互相独立的标签一次性批量计算
+    story_info = label.story_info
+    # 主要情节第一层（取前两个，分别作为主要情节和次要情节）、故事时间、故事文化、特殊时空、
+    # 故事空间、内容风格、特殊设定（两个关键词）、故事套路（两个关键词）
+    base_labels = [story_info.major_storyplot_first, story_info.story_time, story_info.story_culture,
+                   story_info.special_space_time, story_info.story_space, story_info.content_style,
+                   story_info.special_setting, story_info.story_routine]
+    return_counts = [2, 1, 1, 1, 1, 1, 2, 2]
+    results = similarity_between_base_labels_and_sents(sent_words=features.sent_words,
+                                                       sent_strings=features.sent_strings,
+                                                       base_labels=base_labels,
+                                                       sim_word2vector=sim_word2vector,
+                                                       sim_hownet=sim_hownet,
+                                                       sim_cilin=sim_cilin,
+                                                       sim_sent2vector=sim_sent2vector,
+                                                       return_counts=return_counts,
+                                                       features=features)
+    storyplot_enum_names, storyplot_values = results[0]
+    for base_label, (_, value) in zip(base_labels[1:], results[1:]):
+        base_label.value = value
 
     # 主要情节和次要情节标签
-    label.story_info.major_storyplot_first.value = storyplot_values[0]
-    label.story_info.minor_storyplot_first.value = storyplot_values[1]
+    story_info.major_storyplot_first.value = storyplot_values[0]
+    story_info.minor_storyplot_first.value = storyplot_values[1]
 
     # --- 主要情节第二层和次要情节第二层 ---
-    label.story_info.major_storyplot_first.enum_class = storyplot_enum_names[0]
-    label.story_info.minor_storyplot_second.enum_class = storyplot_enum_names[1]
-    ## 分别计算两个第二层的值
-    _, major_storyplot_second_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                              sent_strings=sent_strings,
-                                                                              base_label=label.story_info.major_storyplot_second,
-                                                                              sim_word2vector=sim_word2vector,
-                                                                              sim_hownet=sim_hownet,
-                                                                              sim_cilin=sim_cilin,
-                                                                              sim_sent2vector=sim_sent2vector)
-    _, minor_storyplot_second_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                              sent_strings=sent_strings,
-                                                                              base_label=label.story_info.minor_storyplot_second,
-                                                                              sim_word2vector=sim_word2vector,
-                                                                              sim_hownet=sim_hownet,
-                                                                              sim_cilin=sim_cilin,
-                                                                              sim_sent2vector=sim_sent2vector)
-    label.story_info.major_storyplot_second.value = major_storyplot_second_value
-    label.story_info.minor_storyplot_second.value = minor_storyplot_second_value
-
-    # --- 故事时间 ---
-    _, story_time_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                  sent_strings=sent_strings,
-                                                                  base_label=label.story_info.story_time,
-                                                                  sim_word2vector=sim_word2vector,
-                                                                  sim_hownet=sim_hownet,
-                                                                  sim_cilin=sim_cilin,
-                                                                  sim_sent2vector=sim_sent2vector)
-    label.story_info.story_time.value = story_time_value
-
-    # --- 故事文化 ---
-    _, story_culture_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                     sent_strings=sent_strings,
-                                                                     base_label=label.story_info.story_culture,
-                                                                     sim_word2vector=sim_word2vector,
-                                                                     sim_hownet=sim_hownet,
-                                                                     sim_cilin=sim_cilin,
-                                                                     sim_sent2vector=sim_sent2vector)
-    label.story_info.story_culture.value = story_culture_value
-
-    # --- 特殊时空 ---
-    _, special_space_time_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                          sent_strings=sent_strings,
-                                                                          base_label=label.story_info.special_space_time,
-                                                                          sim_word2vector=sim_word2vector,
-                                                                          sim_hownet=sim_hownet,
-                                                                          sim_cilin=sim_cilin,
-                                                                          sim_sent2vector=sim_sent2vector)
-    label.story_info.special_space_time.value = special_space_time_value
-
-    # --- 故事空间 ---
-    _, story_space_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                   sent_strings=sent_strings,
-                                                                   base_label=label.story_info.story_space,
-                                                                   sim_word2vector=sim_word2vector,
-                                                                   sim_hownet=sim_hownet,
-                                                                   sim_cilin=sim_cilin,
-                                                                   sim_sent2vector=sim_sent2vector)
-    label.story_info.story_space.value = story_space_value
-
-    # --- 内容风格 ---
-    _, content_style_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                     sent_strings=sent_strings,
-                                                                     base_label=label.story_info.content_style,
-                                                                     sim_word2vector=sim_word2vector,
-                                                                     sim_hownet=sim_hownet,
-                                                                     sim_cilin=sim_cilin,
-                                                                     sim_sent2vector=sim_sent2vector)
-    label.story_info.content_style.value = content_style_value
-
-    # --- 特殊设定 ---
-    # List型
-    _, special_setting_values = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                        sent_strings=sent_strings,
-                                                                        base_label=label.story_info.special_setting,
-                                                                        sim_word2vector=sim_word2vector,
-                                                                        sim_hownet=sim_hownet,
-                                                                        sim_cilin=sim_cilin,
-                                                                        sim_sent2vector=sim_sent2vector,
-                                                                        return_counts=2)
-    label.story_info.special_setting.value = special_setting_values
-
-    # --- 故事套路 ---
-    # List型
-    _, story_routine_values = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                      sent_strings=sent_strings,
-                                                                      base_label=label.story_info.story_routine,
-                                                                      sim_word2vector=sim_word2vector,
-                                                                      sim_hownet=sim_hownet,
-                                                                      sim_cilin=sim_cilin,
-                                                                      sim_sent2vector=sim_sent2vector,
-                                                                      return_counts=2)
-    label.story_info.story_routine.value = story_routine_values
+    story_info.major_storyplot_second.enum_class = storyplot_enum_names[0]
+    story_info.minor_storyplot_second.enum_class = storyplot_enum_names[1]
+    ## 同时计算两个第二层的值
+    base_labels = [story_info.major_storyplot_second, story_info.minor_storyplot_second]
+    results = similarity_between_base_labels_and_sents(sent_words=features.sent_words,
+                                                       sent_strings=features.sent_strings,
+                                                       base_labels=base_labels,
+                                                       sim_word2vector=sim_word2vector,
+                                                       sim_hownet=sim_hownet,
+                                                       sim_cilin=sim_cilin,
+                                                       sim_sent2vector=sim_sent2vector,
+                                                       features=features)
+    for base_label, (_, value) in zip(base_labels, results):
+        base_label.value = value
 
 
 def get_role_words_and_sentences(role: Person, stopwords: Set[str]):
@@ -404,103 +362,37 @@ def process_role_and_get_role_labels(role: Person,
                                      sim_cilin: CilinSimilarity,
                                      sim_sent2vector: SentVectorSimilarity,
                                      sent_strings: Optional[List[str]] = None,
-                                     sent_words: Optional[List[str]] = None):
-    """处理单个角色并获取该角色的标签"""
-    if sent_words is None or sent_strings is None:
-        sent_words, sent_strings = get_role_words_and_sentences(role, stopwords=stopwords)
-
-    # --- 角色物种 ---
-    _, role_type_value = similarity_between_base_label_and_sents(sent_words,
-                                                                 sent_strings,
-                                                                 base_label=role_info.role_type,
-                                                                 sim_word2vector=sim_word2vector,
-                                                                 sim_hownet=sim_hownet,
-                                                                 sim_cilin=sim_cilin,
-                                                                 sim_sent2vector=sim_sent2vector)
-    role_info.role_type.value = role_type_value
-
-    # --- 角色初始目标 ---
-    _, role_target_value = similarity_between_base_label_and_sents(sent_words,
-                                                                   sent_strings,
-                                                                   base_label=role_info.role_target,
-                                                                   sim_word2vector=sim_word2vector,
-                                                                   sim_hownet=sim_hownet,
-                                                                   sim_cilin=sim_cilin,
-                                                                   sim_sent2vector=sim_sent2vector)
-    role_info.role_target.value = role_target_value
-
-    # --- 角色职业 ---
-    _, role_job_value = similarity_between_base_label_and_sents(sent_words,
-                                                                sent_strings,
-                                                                base_label=role_info.role_job,
-                                                                sim_word2vector=sim_word2vector,
-                                                                sim_hownet=sim_hownet,
-                                                                sim_cilin=sim_cilin,
-                                                                sim_sent2vector=sim_sent2vector)
-    role_info.role_job.value = role_job_value
-
-    # --- 角色性格 ---
-    _, role_personality_values = similarity_between_base_label_and_sents(sent_words,
-                                                                         sent_strings,
-                                                                         base_label=role_info.role_personality,
-                                                                         sim_word2vector=sim_word2vector,
-                                                                         sim_hownet=sim_hownet,
-                                                                         sim_cilin=sim_cilin,
-                                                                         sim_sent2vector=sim_sent2vector,
-                                                                         return_counts=2)
-    role_info.role_personality.value = role_personality_values
-
-    # --- 角色外形卖点 ---
-    _, role_appearance_value = similarity_between_base_label_and_sents(sent_words,
-                                                                       sent_strings,
-                                                                       base_label=role_info.role_appearance,
-                                                                       sim_word2vector=sim_word2vector,
-                                                                       sim_hownet=sim_hownet,
-                                                                       sim_cilin=sim_cilin,
-                                                                       sim_sent2vector=sim_sent2vector)
-    role_info.role_appearance.value = role_appearance_value
-
-    # --- 角色身份卖点 ---
-    _, role_identity_value = similarity_between_base_label_and_sents(sent_words,
-                                                                     sent_strings,
-                                                                     base_label=role_info.role_identity,
-                                                                     sim_word2vector=sim_word2vector,
-                                                                     sim_hownet=sim_hownet,
-                                                                     sim_cilin=sim_cilin,
-                                                                     sim_sent2vector=sim_sent2vector)
-    role_info.role_identity.value = role_identity_value
-
-    # --- 角色形象卖点 ---
-    _, role_figure_value = similarity_between_base_label_and_sents(sent_words,
-                                                                   sent_strings,
-                                                                   base_label=role_info.role_figure,
-                                                                   sim_word2vector=sim_word2vector,
-                                                                   sim_hownet=sim_hownet,
-                                                                   sim_cilin=sim_cilin,
-                                                                   sim_sent2vector=sim_sent2vector)
-    role_info.role_figure.value = role_figure_value
-
-    # --- 角色行为卖点 ---
-    _, role_behavior_value = similarity_between_base_label_and_sents(sent_words,
-                                                                     sent_strings,
-                                                                     base_label=role_info.role_behavior,
-                                                                     sim_word2vector=sim_word2vector,
-                                                                     sim_hownet=sim_hownet,
-                                                                     sim_cilin=sim_cilin,
-                                                                     sim_sent2vector=sim_sent2vector)
-    role_info.role_behavior.value = role_behavior_value
-
-    # --- 角色反差卖点 ---
-    _, role_contrast_value = similarity_between_base_label_and_sents(sent_words,
-                                                                     sent_strings,
-                                                                     base_label=role_info.role_contrast,
-                                                                     sim_word2vector=sim_word2vector,
-                                                                     sim_hownet=sim_hownet,
-                                                                     sim_cilin=sim_cilin,
-                                                                     sim_sent2vector=sim_sent2vector)
-    role_info.role_contrast.value = role_contrast_value
-
-    return sent_words, sent_strings
+                                     sent_words: Optional[List[str]] = None,
+                                     features: Optional[DocumentFeatures] = None) -> DocumentFeatures:
+    """
+    处理单个角色并获取该角色的标签
+    :param features: DocumentFeatures型（可选），角色的文档特征，为空时根据sent_words和sent_strings计算
+    :return: 该角色的文档特征
+    """
+    if features is None:
+        if sent_words is None or sent_strings is None:
+            sent_words, sent_strings = get_role_words_and_sentences(role, stopwords=stopwords)
+        features = DocumentFeatures(sent_words, sent_strings, sim_word2vector, sim_sent2vector)
+
+    # 角色物种、角色初始目标、角色职业、角色性格（两个关键词）、角色外形卖点、
+    # 角色身份卖点、角色形象卖点、角色行为卖点、角色反差卖点
+    base_labels = [role_info.role_type, role_info.role_target, role_info.role_job,
+                   role_info.role_personality, role_info.role_appearance, role_info.role_identity,
+                   role_info.role_figure, role_info.role_behavior, role_info.role_contrast]
+    return_counts = [1, 1, 1, 2, 1, 1, 1, 1, 1]
+    results = similarity_between_base_labels_and_sents(features.sent_words,
+                                                       features.sent_strings,
+                                                       base_labels=base_labels,
+                                                       sim_word2vector=sim_word2vector,
+                                                       sim_hownet=sim_hownet,
+                                                       sim_cilin=sim_cilin,
+                                                       sim_sent2vector=sim_sent2vector,
+                                                       return_counts=return_counts,
+                                                       features=features)
+    for base_label, (_, value) in zip(base_labels, results):
+        base_label.value = value
+
+    return features
 
 
 def classify_role_info(comic: Comic,
@@ -514,73 +406,57 @@ def classify_role_info(comic: Comic,
                        sent_words: Optional[List[str]] = None):
     """对角色信息中的标签进行分类（主要是第一主角和第二主角）"""
     # 首先对第一主角的标签进行分类
-    first_words, first_strings = process_role_and_get_role_labels(role=comic.first_role,
-                                                                  role_info=label.first_role,
-                                                                  stopwords=stopwords,
-                                                                  sim_word2vector=sim_word2vector,
-                                                                  sim_hownet=sim_hownet,
-                                                                  sim_cilin=sim_cilin,
-                                                                  sim_sent2vector=sim_sent2vector,
-                                                                  sent_words=sent_words,
-                                                                  sent_strings=sent_strings)
+    first_features = process_role_and_get_role_labels(role=comic.first_role,
+                                                      role_info=label.first_role,
+                                                      stopwords=stopwords,
+                                                      sim_word2vector=sim_word2vector,
+                                                      sim_hownet=sim_hownet,
+                                                      sim_cilin=sim_cilin,
+                                                      sim_sent2vector=sim_sent2vector,
+                                                      sent_words=sent_words,
+                                                      sent_strings=sent_strings)
 
     # 接着对第二主角的标签进行分类
-    second_words, second_strings = process_role_and_get_role_labels(role=comic.second_role,
-                                                                    role_info=label.second_role,
-                                                                    stopwords=stopwords,
-                                                                    sim_word2vector=sim_word2vector,
-                                                                    sim_hownet=sim_hownet,
-                                                                    sim_cilin=sim_cilin,
-                                                                    sim_sent2vector=sim_sent2vector,
-                                                                    sent_words=sent_words,
-                                                                    sent_strings=sent_strings)
-
-    # 合并两个角色的单词
+    second_features = process_role_and_get_role_labels(role=comic.second_role,
+                                                       role_info=label.second_role,
+                                                       stopwords=stopwords,
+                                                       sim_word2vector=sim_word2vector,
+                                                       sim_hownet=sim_hownet,
+                                                       sim_cilin=sim_cilin,
+                                                       sim_sent2vector=sim_sent2vector,
+                                                       sent_words=sent_words,
+                                                       sent_strings=sent_strings)
+
+    # 合并两个角色的单词和语句（复用已经计算好的向量）
     # 得到角色之间关系的标签类别
-    sent_words = list(set(first_words + second_words))
-    sent_strings = list(set(first_strings + second_strings))
-
-    # --- 主要角色之间的关系（第一层） ---
-    relation_first_enum_name, relation_first_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                                             sent_strings=sent_strings,
-                                                                                             base_label=label.major_roles_relation_first,
-                                                                                             sim_word2vector=sim_word2vector,
-                                                                                             sim_hownet=sim_hownet,
-                                                                                             sim_cilin=sim_cilin,
-                                                                                             sim_sent2vector=sim_sent2vector)
-    label.major_roles_relation_first.value = relation_first_value
+    features = DocumentFeatures.merge([first_features, second_features])
+
+    # --- 主要角色之间的关系（第一层）、特殊能力、外挂 ---
+    base_labels = [label.major_roles_relation_first, label.special_ability, label.plugin]
+    results = similarity_between_base_labels_and_sents(sent_words=features.sent_words,
+                                                       sent_strings=features.sent_strings,
+                                                       base_labels=base_labels,
+                                                       sim_word2vector=sim_word2vector,
+                                                       sim_hownet=sim_hownet,
+                                                       sim_cilin=sim_cilin,
+                                                       sim_sent2vector=sim_sent2vector,
+                                                       features=features)
+    for base_label, (_, value) in zip(base_labels, results):
+        base_label.value = value
+    relation_first_enum_name = results[0][0]
 
     # --- 主要角色之间的关系（第二层） ---
     label.major_roles_relation_second.enum_class = relation_first_enum_name
-    _, relation_second_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                       sent_strings=sent_strings,
+    _, relation_second_value = similarity_between_base_label_and_sents(sent_words=features.sent_words,
+                                                                       sent_strings=features.sent_strings,
                                                                        base_label=label.major_roles_relation_second,
                                                                        sim_word2vector=sim_word2vector,
                                                                        sim_hownet=sim_hownet,
                                                                        sim_cilin=sim_cilin,
-                                                                       sim_sent2vector=sim_sent2vector)
+                                                                       sim_sent2vector=sim_sent2vector,
+                                                                       features=features)
     label.major_roles_relation_second.value = relation_second_value
 
-    # --- 特殊能力 ---
-    _, special_ability_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                       sent_strings=sent_strings,
-                                                                       base_label=label.special_ability,
-                                                                       sim_word2vector=sim_word2vector,
-                                                                       sim_hownet=sim_hownet,
-                                                                       sim_cilin=sim_cilin,
-                                                                       sim_sent2vector=sim_sent2vector)
-    label.special_ability.value = special_ability_value
-
-    # --- 外挂 ---
-    _, plugin_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                              sent_strings=sent_strings,
-                                                              base_label=label.plugin,
-                                                              sim_word2vector=sim_word2vector,
-                                                              sim_hownet=sim_hownet,
-                                                              sim_cilin=sim_cilin,
-                                                              sim_sent2vector=sim_sent2vector)
-    label.plugin.value = plugin_value
-
 
 def classify_other_info(comic: Comic,
                         label: Label,
@@ -590,31 +466,274 @@ def classify_other_info(comic: Comic,
                         sim_cilin: CilinSimilarity,
                         sim_sent2vector: SentVectorSimilarity,
                         sent_strings: Optional[List[str]] = None,
-                        sent_words: Optional[List[str]] = None):
+                        sent_words: Optional[List[str]] = None,
+                        features: Optional[DocumentFeatures] = None):
     """对其他信息中的标签进行分类"""
     # 首先获取文章中的所有有效单词和语句
-    if sent_words is None or sent_strings is None:
-        sent_strings, sent_words, *_ = get_story_words_and_sentences(comic, stopwords)
-
-    # --- 热门话题 ---
-    _, hot_topic_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                 sent_strings=sent_strings,
-                                                                 base_label=label.others.hot_topic,
-                                                                 sim_word2vector=sim_word2vector,
-                                                                 sim_hownet=sim_hownet,
-                                                                 sim_cilin=sim_cilin,
-                                                                 sim_sent2vector=sim_sent2vector)
-    label.others.hot_topic.value = hot_topic_value
-
-    # --- 其他卖点 ---
-    _, other_points_value = similarity_between_base_label_and_sents(sent_words=sent_words,
-                                                                    sent_strings=sent_strings,
-                                                                    base_label=label.others.other_points,
-                                                                    sim_word2vector=sim_word2vector,
-                                                                    sim_hownet=sim_hownet,
-                                                                    sim_cilin=sim_cilin,
-                                                                    sim_sent2vector=sim_sent2vector)
-    label.others.other_points.value = other_points_value
+    if features is None:
+        if sent_words is None or sent_strings is None:
+            features = get_story_features(comic, stopwords, sim_word2vector, sim_sent2vector)
+        else:
+            features = DocumentFeatures(sent_words, sent_strings, sim_word2vector, sim_sent2vector)
+
+    # --- 热门话题、其他卖点 ---
+    base_labels = [label.others.hot_topic, label.others.other_points]
+    results = similarity_between_base_labels_and_sents(sent_words=features.sent_words,
+                                                       sent_strings=features.sent_strings,
+                                                       base_labels=base_labels,
+                                                       sim_word2vector=sim_word2vector,
+                                                       sim_hownet=sim_hownet,
+                                                       sim_cilin=sim_cilin,
+                                                       sim_sent2vector=sim_sent2vector,
+                                                       features=features)
+    for base_label, (_, value) in zip(base_labels, results):
+        base_label.value = value
+
+
+class OutlineModels:
+    def __init__(self, w2v_file: str):
+        """
+        处理大纲需要用到的所有模型（停用词以及各种相似度计算对象），只需要加载一次
+        :param w2v_file: str型，词向量文件（或者编译好的词向量目录）的路径
+        """
+        start_time = time.time()
+        # 加载停用词
+        self.stopwords = load_stopwords(file=constants.STOPWORDS_FILE)
+
+        # 创建相似度计算的对象
+        # --- 单词相似度部分 ---
+        logger.info("构造单词语义相似度计算对象")
+        self.sim_word2vector = WordVectorSimilarity(w2v_file=w2v_file)
+        logger.info("构造词林相似度对象")
+        self.sim_cilin = CilinSimilarity(cilin_file=constants.CILIN_FILE)
+        logger.info("构造HowNet相似度计算对象")
+        self.sim_hownet = HowNetSimilarity(glossary_file=constants.GLOSSARY_FILE,
+                                           sememe_file=constants.WHOLE_DAT)
+        # --- 语句相似度部分 ---
+        logger.info("构造语句相似度计算对象")
+        self.sim_sent2vector = SentVectorSimilarity(stopwords=self.stopwords,
+                                                    word2vec=self.sim_word2vector.word2vec)
+        # 预先计算所有标签的向量
+        precompute_label_embeddings(self.sim_word2vector, self.sim_sent2vector)
+
+        logger.info(f"初始化共计用时 {time.time() - start_time} s.")
+
+
+# 打标签的各个阶段：基本信息、故事信息、角色信息以及其他信息
+OUTLINE_STAGES = ("base", "story", "role", "other")
+
+
+def analyze_outline_file(source_file: str,
+                         models: OutlineModels,
+                         progress_callback: Optional[Callable[[str, float], None]] = None) -> Dict[str, Any]:
+    """
+    读取一个大纲文件，得到所有的标签以及故事中单词的tfidf值（用于生成词云）
+    :param source_file: str型，大纲文件的路径
+    :param models: OutlineModels型，已经加载好的模型
+    :param progress_callback: 可调用对象（可选），每个阶段（OUTLINE_STAGES）完成时以阶段名和用时（s）为参数调用
+    :return: Dict型，包括小说的名称（novel_name）、标签对象（label）、单词（words）及其tfidf值（tfidf），
+             以及每个阶段的用时（stage_times，单位为s）
+    """
+    # 将文件中的数据转化为Dict型
+    logger.info(f"读取小说大纲文件{source_file}，并转化为Comic对象")
+    document_dict = read_document_to_dict(file=source_file)
+    novel_name = document_dict["小说名"]                     # 小说的名称
+    # 转化为Comic对象
+    comic = Comic()
+    parse_document(document_dict, comic=comic)
+
+    # 获取整个story中的strings和words，并计算一次文档特征，故事信息和其他信息的分类共用
+    story_sent_strings, story_sent_words, words_tfidf, _, story_sent_tokens = get_story_words_and_sentences(
+        comic, models.stopwords)
+    story_features = DocumentFeatures(story_sent_words, story_sent_strings,
+                                      models.sim_word2vector, models.sim_sent2vector,
+                                      sent_tokens=story_sent_tokens)
+
+    # 创建空的Label对象
+    label = Label()
+    stage_times = {}
+
+    start_time = time.time()
+    classify_base_info(comic=comic, label=label)
+    stage_times["base"] = time.time() - start_time
+    if progress_callback is not None:
+        progress_callback("base", stage_times["base"])
+    logger.info(f"得到基本信息的标签，共计用时 {stage_times['base'] * 1000} ms.")
+
+    start_time = time.time()
+    classify_story_info(comic=comic, label=label,
+                        stopwords=models.stopwords,
+                        sim_word2vector=models.sim_word2vector,
+                        sim_cilin=models.sim_cilin,
+                        sim_hownet=models.sim_hownet,
+                        sim_sent2vector=models.sim_sent2vector,
+                        features=story_features)
+    stage_times["story"] = time.time() - start_time
+    if progress_callback is not None:
+        progress_callback("story", stage_times["story"])
+    logger.info(f"得到故事信息的标签，共计用时 {stage_times['story'] * 1000} ms.")
+
+    start_time = time.time()
+    classify_role_info(comic=comic, label=label,
+                       stopwords=models.stopwords,
+                       sim_word2vector=models.sim_word2vector,
+                       sim_cilin=models.sim_cilin,
+                       sim_hownet=models.sim_hownet,
+                       sim_sent2vector=models.sim_sent2vector)
+    stage_times["role"] = time.time() - start_time
+    if progress_callback is not None:
+        progress_callback("role", stage_times["role"])
+    logger.info(f"得到角色信息的标签，共计用时 {stage_times['role'] * 1000} ms.")
+
+    start_time = time.time()
+    classify_other_info(comic=comic, label=label,
+                        stopwords=models.stopwords,
+                        sim_word2vector=models.sim_word2vector,
+                        sim_cilin=models.sim_cilin,
+                        sim_hownet=models.sim_hownet,
+                        sim_sent2vector=models.sim_sent2vector,
+                        features=story_features)
+    stage_times["other"] = time.time() - start_time
+    if progress_callback is not None:
+        progress_callback("other", stage_times["other"])
+    logger.info(f"得到其他信息的标签，共计用时 {stage_times['other'] * 1000} ms.")
+
+    return {"novel_name": novel_name, "label": label, "words": story_sent_words, "tfidf": words_tfidf,
+            "stage_times": stage_times}
+
+
+def process_outline_file(source_file: str, models: OutlineModels) -> Tuple[Optional[str], Label]:
+    """
+    读取一个大纲文件并得到所有的标签
+    :param source_file: str型，大纲文件的路径
+    :param models: OutlineModels型，已经加载好的模型
+    :return: 小说的名称以及标签对象
+    """
+    result = analyze_outline_file(source_file, models)
+    return result["novel_name"], result["label"]
+
+
+def list_outline_files(source_dir: str) -> List[str]:
+    """得到目录中所有的大纲文件（.docx），忽略Word打开文件时生成的临时文件"""
+    files = [file for file in sorted(os.listdir(source_dir))
+             if file.endswith(".docx") and not file.startswith("~$")
+             and os.path.isfile(os.path.join(source_dir, file))]
+    return [os.path.join(source_dir, file) for file in files]
+
+
+# 多进程处理时子进程使用的模型，在fork之前由父进程设置，子进程以写时复制的方式共享
+_WORKER_MODELS: Optional[OutlineModels] = None
+# gc.freeze是进程全局的状态，批量处理和模型服务（以及重新初始化时新旧两个模型服务）共用，
+# 最后一个使用者结束时才解冻
+_GC_FREEZE_COUNT = 0
+_GC_FREEZE_LOCK = threading.Lock()
+
+
+def freeze_gc():
+    """将已经加载的对象移出垃圾回收的跟踪范围，避免子进程中的垃圾回收触发大量的内存页复制"""
+    global _GC_FREEZE_COUNT
+    with _GC_FREEZE_LOCK:
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        _GC_FREEZE_COUNT += 1
+
+
+def unfreeze_gc():
+    """与freeze_gc成对调用，所有的使用者都结束之后才解冻"""
+    global _GC_FREEZE_COUNT
+    with _GC_FREEZE_LOCK:
+        _GC_FREEZE_COUNT -= 1
+        if _GC_FREEZE_COUNT == 0 and hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+
+
+def _process_outline_task(source_file: str,
+                          models: Optional[OutlineModels] = None) -> Tuple[str, Optional[str], Optional[Label], float, Optional[str]]:
+    """
+    处理一个大纲文件，不抛出异常
+    :return: 文件路径、小说名称、标签对象、用时（s）以及错误信息（成功时为None）
+    """
+    if models is None:
+        models = _WORKER_MODELS
+    start_time = time.time()
+    try:
+        novel_name, label = process_outline_file(source_file, models)
+    except Exception as e:
+        logger.error(f"处理大纲文件{source_file}出错!@{e}")
+        return source_file, None, None, time.time() - start_time, str(e)
+    return source_file, novel_name, label, time.time() - start_time, None
+
+
+def iter_process_outline_files(source_files: List[str],
+                               models: OutlineModels,
+                               num_workers: int = 1) -> Iterator[Tuple[str, Optional[str], Optional[Label], float, Optional[str]]]:
+    """
+    处理多个大纲文件，按照文件的顺序依次返回结果（结果的格式同_process_outline_task）
+    当num_workers大于1时使用多进程处理，模型在fork之前已经加载，子进程只读共享；
+    标签对象返回给调用者统一保存，因此只有一个进程写excel文件；
+    子进程异常退出时，已经完成的结果都保留，未完成的文件逐个重新处理，导致子进程退出的文件以错误信息的形式返回
+    :param num_workers: int型，进程的数量
+    """
+    if num_workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("当前平台不支持fork方式创建进程，改为使用单进程处理")
+        num_workers = 1
+    if num_workers <= 1:
+        for source_file in source_files:
+            yield _process_outline_task(source_file, models)
+        return
+
+    global _WORKER_MODELS
+    _WORKER_MODELS = models
+    freeze_gc()
+    ctx = multiprocessing.get_context("fork")
+    results: Dict[int, Tuple[str, Optional[str], Optional[Label], float, Optional[str]]] = {}
+    next_index = 0
+
+    def _ready_results():
+        """按照文件的顺序返回已经得到的结果"""
+        nonlocal next_index
+        while next_index in results:
+            yield results.pop(next_index)
+            next_index += 1
+
+    try:
+        # 子进程异常退出（例如内存不足被杀死）时进程池不可用，所有未完成的任务都会抛出BrokenProcessPool，
+        # 已经完成的结果都保留，只有未完成的文件需要重新处理
+        unfinished = []
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx) as executor:
+            futures = {executor.submit(_process_outline_task, source_file): i
+                       for i, source_file in enumerate(source_files)}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except BrokenProcessPool:
+                    unfinished.append(futures[future])
+                    continue
+                yield from _ready_results()
+
+        if unfinished:
+            # 无法确定是哪个文件导致子进程退出，因此逐个在单独的进程中重新处理，导致子进程退出的文件记为失败
+            logger.warning(f"处理大纲时子进程异常退出，逐个重新处理剩余的{len(unfinished)}个文件")
+            executor = None
+            try:
+                for i in sorted(unfinished):
+                    source_file = source_files[i]
+                    if executor is None:
+                        executor = ProcessPoolExecutor(max_workers=1, mp_context=ctx)
+                    try:
+                        results[i] = executor.submit(_process_outline_task, source_file).result()
+                    except BrokenProcessPool as e:
+                        logger.error(f"处理大纲文件{source_file}时子进程异常退出!@{e}")
+                        results[i] = (source_file, None, None, 0.0, f"worker process terminated abruptly: {e}")
+                        executor.shutdown()
+                        executor = None
+                    yield from _ready_results()
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+    finally:
+        unfreeze_gc()
+        _WORKER_MODELS = None
 
 
 if __name__ == '__main__':
@@ -2,14 +2,13 @@
 # @Author: 莫冉
 # @Date: 2021-01-26
 import novela.constants as constants
-from novela.enum_labels import lazy_load_enums, LabelEnum, ENUM_NAMES
+from novela.enum_labels import load_label_registry, LabelEnum, ENUM_NAMES
 from novela.utils.common import init_logger
 
 
 if len(ENUM_NAMES) == 0:
-    # 预定义所有的枚举类
-    for path in constants.ALL_LABELS_PATH:
-        lazy_load_enums(path)
+    # 登记所有的枚举类（优先读取注册表缓存），枚举类在第一次使用时才创建
+    load_label_registry(constants.ALL_LABELS_PATH, constants.LABEL_REGISTRY_FILE)
 
     # 配置logger的对象
     logger = init_logger(constants.LOG_FILE)
@@ -3,14 +3,19 @@
 # @Date: 2021-01-22
 import inspect
 import enum
-from typing import Iterable, Any
+from typing import Iterable, Any, Dict, List
 
 
 class LabelEnumMeta(enum.EnumMeta):
     """用于单层枚举类的元类"""
+    # 所有由该元类创建的枚举类，键为小写的类名，值为同名（不区分大小写）的枚举类
+    _class_registry: Dict[str, List[Any]] = {}
+
     def __new__(mcs, name, bases, attrs):
         obj = super().__new__(mcs, name, bases, attrs)
         obj._value2member_map_ = {}
+        # 中文名到枚举成员的索引（同名时保留第一个）
+        obj._display_name2member_map_ = {}
         # value表示这个值对应的索引
         # display_name表示这个枚举类对应的中文名
         # description对应该枚举类的描述
@@ -39,6 +44,9 @@ class LabelEnumMeta(enum.EnumMeta):
             else:
                 value = m.value
             obj._value2member_map_[value] = m
+            if hasattr(m, "display_name"):
+                obj._display_name2member_map_.setdefault(m.display_name, m)
+        LabelEnumMeta._class_registry.setdefault(name.lower(), []).append(obj)
         return obj
 
 
@@ -60,8 +68,14 @@ class LoadEnumInterface(enum.Enum):
         :param cls_name (str): target class name
         :return:
         """
+        registry = getattr(type(cls), "_class_registry", None)
+        if registry is not None:
+            # 直接从元类的注册表中查找，不需要遍历所有的子类
+            subclasses = [c for c in registry.get(class_name.lower(), []) if c is not cls and issubclass(c, cls)]
+        else:
+            subclasses = cls.get_all_subclasses()
         result = None
-        for subclass in cls.get_all_subclasses():
+        for subclass in subclasses:
             # print(subclass.__name__.lower())
             if subclass.__name__.lower() == class_name.lower():
                 if result is None:
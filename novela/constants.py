@@ -30,6 +30,14 @@ WHOLE_DAT = os.path.join(RESOURCE_PATH, "WHOLE.DAT")
 STOPWORDS_FILE = os.path.join(RESOURCE_PATH, "stopwords.txt")
 FONT_FILE = os.path.join(RESOURCE_PATH, "FZYTK.TTF")
 
+# --------------- 缓存文件的路径 -----------------
+CACHE_PATH = os.path.join(PROJECT_PATH, "data/cache")
+# 分词缓存最多保存的语句数量以及缓存文件
+SEGMENT_CACHE_SIZE = 200000
+SEGMENT_CACHE_FILE = os.path.join(CACHE_PATH, "segment_cache.pkl")
+# 所有标签枚举类定义的注册表缓存
+LABEL_REGISTRY_FILE = os.path.join(CACHE_PATH, "label_registry.pkl")
+
 # --------------- 日志文件的配置 -------------------
 
 PACKAGE_NAME = os.path.basename(os.path.dirname(__file__))
@@ -41,3 +49,15 @@ LOG_FILE = os.path.join(PROJECT_PATH, "novel.log")
 ALL_LABELS_PATH = [BASE_INFO, IMAGE_INFO, STORY_INFO,
                    ROLE_INFO, OTHER_INFO]
 
+
+# --------------- 模型服务的配置 -------------------
+# 常驻模型服务中处理大纲的进程数量
+MODEL_SERVER_WORKERS = 2
+# 异步分析任务的队列长度（等待中和正在处理的任务总数），超过之后拒绝新的任务
+ANALYSIS_QUEUE_SIZE = 32
+# 同步的/analysis接口等待任务结束的最长时间（s），超时之后可以通过返回的job_id查询结果
+ANALYSIS_SYNC_TIMEOUT = 600
+# 最多保留的已经结束的任务数量，超过之后删除最早结束的任务
+ANALYSIS_JOB_HISTORY = 100
+# 推送任务进度时，两次状态变化之间发送心跳的间隔（s），避免反向代理断开连接
+ANALYSIS_STREAM_HEARTBEAT = 15
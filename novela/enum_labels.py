@@ -1,47 +1,61 @@
 # coding=utf-8
 # @Author: 莫冉
 # @Date: 2021-01-22
-from typing import Dict
+from typing import Dict, List, Tuple, Any, Optional
 import os
+import gc
 import json
+import pickle
 from novela._utils.metaclass import LabelEnumMeta, LoadEnumInterface
+import novela.constants as constants
 
 
+# 标签注册表缓存的版本号，缓存中保存的内容发生变化时需要增加
+REGISTRY_VERSION = 1
+
 ENUM_NAMES = []
+# 所有枚举类的定义，键为枚举类的类名，值为(中文类名, 枚举类数据域的键值对)，
+# 其中存在二级类别时，数据域中保存的是二级类别枚举类的类名，枚举类在第一次使用时才创建
+_ENUM_SPECS: Dict[str, Tuple[str, Dict[str, List[Any]]]] = {}
+# 枚举类类名的索引，键为小写的类名
+_ENUM_NAME_INDEX: Dict[str, str] = {}
+# 已经创建的枚举类，键为枚举类的类名
+_ENUM_CLASSES: Dict[str, LabelEnumMeta] = {}
 
 
 class LabelEnum(LoadEnumInterface, metaclass=LabelEnumMeta):
     r"""
     Base of all label enum
     """
+    @classmethod
+    def load_class(cls, class_name) -> Any:
+        # 注册表中的枚举类在第一次加载时才创建
+        enum_name = _ENUM_NAME_INDEX.get(class_name.lower())
+        if enum_name is not None:
+            get_enum_class(enum_name)
+        return super().load_class(class_name)
 
 
 def lazy_load_enums(path: str):
-    """根据路径中的文件将类别加载成枚举类"""
+    """根据路径中的文件登记枚举类的定义，枚举类在第一次使用时才创建"""
     files = os.listdir(path)
     for file in files:
         # 首先根据文件名获取类的中文名
         enum_cn_name, enum_name = file.split("_")
         enum_name = enum_name[:-5]
-        global ENUM_NAMES
-        if enum_name not in ENUM_NAMES:
+        if enum_name not in _ENUM_SPECS:
             with open(os.path.join(path, file), 'r', encoding="utf-8") as f:
                 data = json.load(f)
             result_dict = arrange_as_dict(data)
-            # 定义该枚举类并添加到全局变量中
-            globals()[enum_name] = LabelEnum(enum_name, result_dict)
-            # 为每个枚举类定义中文名的常规属性（这个属性不属于枚举属性）
-            # 这个操作必须在枚举类定义结束之后执行
-            globals()[enum_name].cn_name = enum_cn_name
-            ENUM_NAMES.append(enum_name)
+            _register_enum(enum_name, enum_cn_name, result_dict)
 
 
 def arrange_as_dict(data: Dict):
-    """根据原始数据中的字段组织成枚举类数据域的键值对"""
+    """根据原始数据中的字段组织成枚举类数据域的键值对（二级类别用枚举类的类名表示）"""
     result_dict = {}
     for i, (cls_name, cls_dict) in enumerate(data.items()):
         # 如果当前字典中包含children这个字段
-        # 则首先生成children这个枚举类
+        # 则首先登记children这个枚举类
         # child枚举类的名称就是对应的var_name的title形式
         if "children" in cls_dict:
             var_name = cls_dict["var_name"]
@@ -49,14 +63,13 @@ def arrange_as_dict(data: Dict):
             description = None if "description" not in cls_dict else cls_dict["description"]
             # 先获取第二层级特征的枚举类类名
             children_enum_name = var_name.title()
-            # 在全局变量中定义该children的枚举类
             if len(children) <= 0:
                 item_list = [i, cls_name, description, None]
             else:
                 gen_children_enum_class(enum_name=children_enum_name,
                                         enum_cn_name=cls_name,
                                         data=cls_dict["children"])
-                item_list = [i, cls_name, description, globals()[children_enum_name]]
+                item_list = [i, cls_name, description, children_enum_name]
             result_dict[var_name] = item_list
         elif "var_name" in cls_dict and "description" in cls_dict:
             item_list = [i, cls_name, cls_dict["description"]]
@@ -71,20 +84,123 @@ def arrange_as_dict(data: Dict):
 
 
 def gen_children_enum_class(enum_name: str, enum_cn_name: str, data: Dict):
-    """用于生成enum中children的枚举类"""
-    global ENUM_NAMES
-    if enum_name not in ENUM_NAMES:
+    """用于登记enum中children的枚举类"""
+    if enum_name not in _ENUM_SPECS:
         result_dict = arrange_as_dict(data)
-        globals()[enum_name] = LabelEnum(enum_name, result_dict)
-        globals()[enum_name].cn_name = enum_cn_name    # 定义孩子枚举类的中文类别名
-        # 将定义好的枚举类类名保存，便于动态加载
-        ENUM_NAMES.append(enum_name)
+        _register_enum(enum_name, enum_cn_name, result_dict)
+
+
+def _register_enum(enum_name: str, enum_cn_name: str, result_dict: Dict[str, List[Any]]):
+    """登记枚举类的定义，并将类名保存，便于动态加载"""
+    _ENUM_SPECS[enum_name] = (enum_cn_name, result_dict)
+    _ENUM_NAME_INDEX[enum_name.lower()] = enum_name
+    ENUM_NAMES.append(enum_name)
+
+
+def get_enum_class(enum_name: str) -> Optional[LabelEnumMeta]:
+    """
+    获取枚举类，第一次获取时根据登记的定义创建（同时创建其二级类别的枚举类）
+    :param enum_name: str型，枚举类的类名
+    :return: 枚举类，没有登记时返回None
+    """
+    enum_class = _ENUM_CLASSES.get(enum_name)
+    if enum_class is not None or enum_name not in _ENUM_SPECS:
+        return enum_class
+    enum_cn_name, result_dict = _ENUM_SPECS[enum_name]
+    members = {}
+    for var_name, item_list in result_dict.items():
+        if len(item_list) == 4 and item_list[3] is not None:
+            item_list = item_list[:3] + [get_enum_class(item_list[3])]
+        else:
+            item_list = list(item_list)
+        members[var_name] = item_list
+    # 定义该枚举类并添加到全局变量中
+    enum_class = LabelEnum(enum_name, members)
+    # 为每个枚举类定义中文名的常规属性（这个属性不属于枚举属性）
+    # 这个操作必须在枚举类定义结束之后执行
+    enum_class.cn_name = enum_cn_name
+    _ENUM_CLASSES[enum_name] = enum_class
+    globals()[enum_name] = enum_class
+    return enum_class
+
+
+def __getattr__(name: str):
+    """支持`from novela.enum_labels import Source`的方式获取尚未创建的枚举类"""
+    if name in _ENUM_SPECS:
+        return get_enum_class(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
+def _registry_key(paths: List[str]) -> Dict[str, Any]:
+    """注册表缓存的键，由缓存版本以及所有标签文件的文件名、修改时间和大小组成"""
+    files = []
+    for path in paths:
+        for file in os.listdir(path):
+            stat = os.stat(os.path.join(path, file))
+            files.append((path, file, stat.st_mtime_ns, stat.st_size))
+    return {"version": REGISTRY_VERSION, "files": files}
+
+
+def build_label_registry(paths: List[str] = constants.ALL_LABELS_PATH,
+                         registry_file: Optional[str] = constants.LABEL_REGISTRY_FILE):
+    """
+    解析所有的标签文件并登记枚举类，然后将解析的结果保存为一个注册表缓存文件
+    :param paths: List[str]型，标签文件所在的目录
+    :param registry_file: str型（可选），注册表缓存文件的路径，为None时不保存
+    """
+    key = _registry_key(paths)
+    for path in paths:
+        lazy_load_enums(path)
+    if registry_file is None:
+        return
+    registry = {"key": key, "names": ENUM_NAMES, "specs": _ENUM_SPECS}
+    try:
+        registry_dir = os.path.dirname(registry_file)
+        if not os.path.isdir(registry_dir):
+            os.makedirs(registry_dir)
+        tmp_file = registry_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(registry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, registry_file)
+    except OSError:
+        # 无法写入缓存时（例如只读的安装目录）下次仍然解析标签文件
+        pass
+
+
+def load_label_registry(paths: List[str] = constants.ALL_LABELS_PATH,
+                        registry_file: Optional[str] = constants.LABEL_REGISTRY_FILE):
+    """
+    加载所有的枚举类定义：如果注册表缓存和标签文件一致，则一次读取缓存，否则重新解析标签文件并保存缓存
+    :param paths: List[str]型，标签文件所在的目录
+    :param registry_file: str型（可选），注册表缓存文件的路径
+    """
+    if registry_file is not None and os.path.isfile(registry_file):
+        gc_enabled = gc.isenabled()
+        try:
+            gc.disable()
+            with open(registry_file, "rb") as f:
+                registry = pickle.load(f)
+            valid = registry.get("key") == _registry_key(paths)
+        except Exception:
+            valid = False
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if valid:
+            for enum_name in registry["names"]:
+                if enum_name not in _ENUM_SPECS:
+                    enum_cn_name, result_dict = registry["specs"][enum_name]
+                    _register_enum(enum_name, enum_cn_name, result_dict)
+            return
+    build_label_registry(paths, registry_file)
+
 
 if __name__ == '__main__':
-    Source = LabelEnum("Source", {"YC": [1, "原创"], "TV": [2, "漫改"]})
+    # 重新生成标签注册表的缓存文件
+    build_label_registry()
+    print(f"共登记了 {len(ENUM_NAMES)} 个枚举类，保存到{constants.LABEL_REGISTRY_FILE}")
 
+    Source = LabelEnum.load_class("Source")
     print(LabelEnum.__subclasses__())
     print(Source.YC.value)
-    print(Source.YC.display_name)
\ No newline at end of file
+    print(Source.YC.display_name)
@@ -1,12 +1,37 @@
 # coding=utf-8
 # @Author: 莫冉
 # @Date: 2021-01-26
-from typing import List, Union
+from typing import List, Union, Tuple, FrozenSet, NamedTuple, Any
+from functools import lru_cache
 from collections import OrderedDict
 
 from novela import LabelEnum, logger
 
 
+class EnumTemplate(NamedTuple):
+    """一个枚举类对应的标签属性，所有使用该枚举类的标签共享（不可修改）"""
+    enum_names: Tuple[str, ...]
+    enum_values: Tuple[Any, ...]
+    display_names: Tuple[str, ...]
+    descriptions: Tuple[str, ...]
+    display_name_set: FrozenSet[str]
+
+
+@lru_cache(maxsize=None)
+def get_enum_template(enum_class) -> EnumTemplate:
+    """每个枚举类只遍历一次，得到枚举类类别的英文名、值、中文名以及描述"""
+    enum_names, enum_values, display_names, descriptions = [], [], [], []
+    for item in enum_class:
+        enum_names.append(item.name)   # enum_names对应的是枚举类类别的英文名
+        enum_values.append(item.value)
+        if hasattr(item, "display_name"):
+            display_names.append(item.display_name)
+        if hasattr(item, "description"):
+            descriptions.append(item.description)
+    return EnumTemplate(tuple(enum_names), tuple(enum_values), tuple(display_names), tuple(descriptions),
+                        frozenset(display_names))
+
+
 class BaseLabel:
     def __init__(self,
                  enum_name: str = None,
@@ -32,21 +57,38 @@ class BaseLabel:
 
         self._value = None   # 表示标签值
 
-        self.enum_names = []
-        self.enum_values = []
-        self.display_names = []
-        self.descriptions = []
+        # 下面的属性都是和其他相同枚举类的标签共享的tuple
+        self.enum_names = ()
+        self.enum_values = ()
+        self.display_names = ()
+        self.descriptions = ()
+        self._display_name_set = frozenset()    # display_names的集合，用于快速判断标签值是否合法
         if self._enum_class is not None:
             self._init_enum_attrs()
 
     def _init_enum_attrs(self):
-        for item in self._enum_class:
-            self.enum_names.append(item.name)   # enum_names对应的是枚举类类别的英文名
-            self.enum_values.append(item.value)
-            if hasattr(item, "display_name"):
-                self.display_names.append(item.display_name)
-            if hasattr(item, "description"):
-                self.descriptions.append(item.description)
+        template = get_enum_template(self._enum_class)
+        if not self.enum_names:
+            self.enum_names = template.enum_names
+            self.enum_values = template.enum_values
+            self.display_names = template.display_names
+            self.descriptions = template.descriptions
+            self._display_name_set = template.display_name_set
+        else:
+            # 已经设置过枚举类时，在原来的基础上追加
+            self.enum_names = self.enum_names + template.enum_names
+            self.enum_values = self.enum_values + template.enum_values
+            self.display_names = self.display_names + template.display_names
+            self.descriptions = self.descriptions + template.descriptions
+            self._display_name_set = self._display_name_set | template.display_name_set
+
+    def clone(self) -> "BaseLabel":
+        """复制标签，枚举类相关的属性直接共享，只有标签值属于新的标签"""
+        label = BaseLabel.__new__(BaseLabel)
+        label.__dict__.update(self.__dict__)
+        if isinstance(self._value, list):
+            label._value = list(self._value)
+        return label
 
     @property
     def value(self):
@@ -60,8 +102,8 @@ class BaseLabel:
             else:
                 v_list = v
             for v_item in v_list:
-                if v_item not in self.display_names:
-                    raise ValueError(f"`{v}`不存在于当前枚举类的标签中`{self.display_names}`!!")
+                if v_item not in self._display_name_set:
+                    raise ValueError(f"`{v}`不存在于当前枚举类的标签中`{list(self.display_names)}`!!")
             self._value = v
 
 
@@ -83,15 +125,14 @@ class BaseLabel:
         yield from self.enum_class
 
     def get_enum_according_display_name(self, display_name: str):
-        for item in self.enum_class:
-            if hasattr(item, "display_name"):
-                if item.display_name == display_name:
-                    return item
+        return self.enum_class._display_name2member_map_.get(display_name)
 
     def get_enum_according_value(self, value: int):
-        for item in self.enum_class:
-            if item.value == value:
-                return item
+        try:
+            return self.enum_class._value2member_map_.get(value)
+        except TypeError:
+            # 不可哈希的值不可能是枚举类的值
+            return None
 
     def to_json(self):
         if self._value is not None and isinstance(self._value, list):
@@ -111,25 +152,44 @@ class StringLabel:
     def to_json(self):
         return {self.name: self.value}
 
+    def clone(self) -> "StringLabel":
+        return StringLabel(name=self.name, value=self.value)
+
 
 # --------------------------------------------------------
 
 
 class InfoInterface:
     """所有标签信息类的父类"""
+    __slots__ = ()
+    # 子类中所有标签字段的名称，按照字段名排序（与之前通过dir()得到的顺序一致，保证输出的列顺序不变）
+    _fields: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(sorted(cls.__slots__))
+
+    def clone(self):
+        """复制标签信息，其中的每个标签都调用clone方法复制"""
+        info = self.__class__.__new__(self.__class__)
+        for attr in self._fields:
+            setattr(info, attr, getattr(self, attr).clone())
+        return info
+
     def to_json(self):
         result = OrderedDict()
-        custom_attrs = [attr for attr in dir(self)
-                        if ((not callable(getattr(self, attr))) and (not attr.startswith("__")))]
-        for attr in custom_attrs:
+        for attr in self._fields:
             attr_value = getattr(self, attr)
-            if isinstance(attr_value, StringLabel) or isinstance(attr_value, BaseLabel):
+            if isinstance(attr_value, (StringLabel, BaseLabel)):
                 result.update(attr_value.to_json())
         return result
 
 
 class BaseInfo(InfoInterface):
     """基本信息"""
+    __slots__ = ("source", "serial", "original_author", "comic_script_writer", "comic_editor", "user_gender",
+                 "gender_compatible")
+
     def __init__(self):
         self.source: BaseLabel = BaseLabel(enum_name="Source")                               # 对应“是否原创”
         self.serial: BaseLabel = BaseLabel(enum_name="Serial")                               # 对应“连载状况”
@@ -142,6 +202,8 @@ class BaseInfo(InfoInterface):
 
 class ImageInfo(InfoInterface):
     """画面信息"""
+    __slots__ = ("comic_effect", "comic_force", "comic_type")
+
     def __init__(self):
         self.comic_effect: BaseLabel = BaseLabel(enum_name="ComicEffect")               # 对应“画面效果”
         self.comic_force: BaseLabel = BaseLabel(enum_name="ComicForce")                 # 对应“画面表现力”
@@ -150,6 +212,10 @@ class ImageInfo(InfoInterface):
 
 class StoryInfo(InfoInterface):
     """故事信息"""
+    __slots__ = ("major_storyplot_first", "major_storyplot_second", "minor_storyplot_first", "minor_storyplot_second",
+                 "story_time", "story_culture", "special_space_time", "story_space", "content_style",
+                 "special_setting", "story_routine")
+
     def __init__(self):
         self.major_storyplot_first: BaseLabel = BaseLabel(enum_name="StoryPlot",
                                                           name="主要情节（第一层）")              # 对应“主要情节第一层”
@@ -170,6 +236,9 @@ class StoryInfo(InfoInterface):
 
 class RoleInfo(InfoInterface):
     """角色信息"""
+    __slots__ = ("role_type", "role_target", "role_job", "role_personality", "role_appearance", "role_identity",
+                 "role_figure", "role_behavior", "role_contrast")
+
     def __init__(self):
         self.role_type: BaseLabel = BaseLabel(enum_name="RoleType")                          # 对应“角色物种”
         self.role_target: BaseLabel = BaseLabel(enum_name="RoleTarget")                      # 对应“角色初始目标”
@@ -184,6 +253,8 @@ class RoleInfo(InfoInterface):
 
 class OtherInfo(InfoInterface):
     """其他信息"""
+    __slots__ = ("hot_topic", "other_points")
+
     def __init__(self):
         self.hot_topic: BaseLabel = BaseLabel(enum_name="HotTopic")                     # 对应“话题热点”
         self.other_points: BaseLabel = BaseLabel(enum_name="OtherPoints")               # 对应“其他卖点”（多个用/分开）
@@ -193,7 +264,19 @@ class OtherInfo(InfoInterface):
 
 
 class Label:
+    # 标签对象的原型，第一次构造时创建，之后的标签对象都直接从原型复制，
+    # 不需要重新加载枚举类以及遍历枚举类的类别
+    _prototype: "Label" = None
+
     def __init__(self):
+        if Label._prototype is None:
+            prototype = Label.__new__(Label)
+            prototype._init_labels()
+            Label._prototype = prototype
+        for attr, attr_value in Label._prototype.__dict__.items():
+            self.__dict__[attr] = attr_value.clone()
+
+    def _init_labels(self):
         self.base_info = BaseInfo()                          # 基本信息
         self.image_info = ImageInfo()
         self.story_info = StoryInfo()                        # 故事信息
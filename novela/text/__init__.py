@@ -5,6 +5,7 @@ from novela.text.sim_cilin import CilinSimilarity
 from novela.text.sim_hownet import HowNetSimilarity
 from novela.text.sim_word2vec import WordVectorSimilarity
 from novela.text.sentsim_word2vec import SentVectorSimilarity
+from novela.text.features import DocumentFeatures
 
 
-__all__ = ["CilinSimilarity", "HowNetSimilarity", "WordVectorSimilarity", "SentVectorSimilarity"]
\ No newline at end of file
+__all__ = ["CilinSimilarity", "HowNetSimilarity", "WordVectorSimilarity", "SentVectorSimilarity", "DocumentFeatures"]
\ No newline at end of file
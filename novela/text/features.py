@@ -0,0 +1,71 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-02
+from typing import List, Optional, Sequence, Tuple, Dict
+import numpy as np
+
+from novela.text.sim_word2vec import WordVectorSimilarity, normalize_rows
+from novela.text.sentsim_word2vec import SentVectorSimilarity
+from novela.utils.segment_cache import cached_cut
+
+
+def _unique_rows(key_lists: Sequence[Sequence]) -> Tuple[List, List[Tuple[int, int]]]:
+    """
+    对多个列表中的元素去重（保留第一次出现的顺序）
+    :return: 去重后的元素，以及每个元素在原来的第几个列表的第几行
+    """
+    positions: Dict = {}
+    for i, keys in enumerate(key_lists):
+        for j, key in enumerate(keys):
+            if key not in positions:
+                positions[key] = (i, j)
+    return list(positions.keys()), list(positions.values())
+
+
+class DocumentFeatures:
+    def __init__(self,
+                 sent_words: List[str],
+                 sent_strings: List[str],
+                 sim_word2vector: WordVectorSimilarity,
+                 sim_sent2vector: SentVectorSimilarity,
+                 sent_tokens: Optional[List[List[str]]] = None):
+        """
+        一篇文档（或者一个角色）的分词结果、词向量矩阵、句向量矩阵以及对应的mask，
+        每篇文档只计算一次，之后所有标签的分类都直接使用
+        :param sent_words: List[str]型，文档中的有效单词
+        :param sent_strings: List[str]型，文档中的语句
+        :param sent_tokens: List[List[str]]型（可选），每个语句的分词结果，为空时使用jieba分词（使用分词缓存）
+        """
+        self.sent_words = sent_words
+        self.sent_strings = sent_strings
+        if sent_tokens is None:
+            sent_tokens = [cached_cut(sent) for sent in sent_strings]
+        self.sent_tokens = sent_tokens
+
+        # 按行归一化后的词向量矩阵 [words_num, vector_size] 以及mask [words_num]
+        word_matrix, self.word_mask = sim_word2vector._get_matrix_and_mask(sent_words, is_cut=True)
+        self.word_matrix = normalize_rows(word_matrix.reshape(len(sent_words), sim_word2vector.vector_size))
+        # 按行归一化后的句向量矩阵 [sentence_num, vector_size] 以及mask [sentence_num]
+        sent_matrix, self.sent_mask = sim_sent2vector._get_matrix_and_mask(sent_tokens)
+        self.sent_matrix = normalize_rows(sent_matrix.reshape(len(sent_tokens), sim_sent2vector.vector_size))
+
+    @classmethod
+    def merge(cls, features_list: List["DocumentFeatures"]) -> "DocumentFeatures":
+        """
+        合并多个文档的特征（例如两个主角），去除重复的单词和语句，直接复用已经计算好的向量
+        """
+        merged = cls.__new__(cls)
+        merged.sent_words, word_rows = _unique_rows([f.sent_words for f in features_list])
+        merged.sent_strings, sent_rows = _unique_rows([f.sent_strings for f in features_list])
+        merged.sent_tokens = [features_list[i].sent_tokens[j] for i, j in sent_rows]
+
+        def gather(attr: str, rows: List[Tuple[int, int]]) -> np.ndarray:
+            if not rows:
+                return np.concatenate([getattr(f, attr) for f in features_list])
+            return np.stack([getattr(features_list[i], attr)[j] for i, j in rows])
+
+        merged.word_matrix = gather("word_matrix", word_rows)
+        merged.word_mask = gather("word_mask", word_rows)
+        merged.sent_matrix = gather("sent_matrix", sent_rows)
+        merged.sent_mask = gather("sent_mask", sent_rows)
+        return merged
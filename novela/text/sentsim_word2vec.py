@@ -1,15 +1,17 @@
 # coding=utf-8
 # @Author: 莫冉
 # @Date: 2021-02-03
-import jieba
-from typing import Union, Dict, List, Optional, Tuple, Set
+from typing import Union, Dict, List, Optional, Tuple, Set, TYPE_CHECKING
 import numpy as np
-from gensim.models.word2vec import Word2VecKeyedVectors
-from sklearn.metrics.pairwise import cosine_similarity
 
 from novela import logger
 from novela.utils.common import load_stopwords
-from novela.text.sim_word2vec import WordVectorSimilarity
+from novela.utils.segment_cache import cached_cut
+from novela.text.sim_word2vec import WordVectorSimilarity, normalize_rows, masked_cosine_sim
+
+if TYPE_CHECKING:
+    # 只用于类型注解，运行时不导入gensim
+    from gensim.models.word2vec import Word2VecKeyedVectors
 
 
 logger = logger.getChild("sentvector")
@@ -19,7 +21,7 @@ class SentVectorSimilarity(WordVectorSimilarity):
     def __init__(self,
                  w2v_file: str = None,
                  stopwords: Optional[Union[str, Set[str]]] = None,
-                 word2vec: Union[Word2VecKeyedVectors, Dict[str, np.ndarray]] = None):
+                 word2vec: Union["Word2VecKeyedVectors", Dict[str, np.ndarray]] = None):
         super().__init__(w2v_file, word2vec)
 
         if stopwords is None:
@@ -32,7 +34,7 @@ class SentVectorSimilarity(WordVectorSimilarity):
     def _get_sent_vector(self, sent: Union[str, List[str]]):
         # 如果是str型则要进行分词
         if isinstance(sent, str):
-            sent = jieba.lcut(sent)
+            sent = cached_cut(sent)
 
         sent_vector = np.zeros(self.vector_size)
         valid = 0
@@ -90,15 +92,29 @@ class SentVectorSimilarity(WordVectorSimilarity):
         sent_list1_matrix, sent_list1_mask = self._get_matrix_and_mask(sent_list1)
         sent_list2_matrix, sent_list2_mask = self._get_matrix_and_mask(sent_list2)
 
-        # 使用cosine_similarity计算相似度
-        similarities = cosine_similarity(sent_list1_matrix, sent_list2_matrix)
-
-        # 余弦相似度的范围在[-1, 1]之间，这里归一化到[0, 1]之间
-        similarities = (similarities + 1) / 2
-
-        s1_expand = np.expand_dims(sent_list1_mask, axis=1).astype(np.int8)
-        s2_expand = np.expand_dims(sent_list2_mask, axis=0).astype(np.int8)
-        masks = (s1_expand & s2_expand).astype(np.float16)
-
-        similarities = similarities * masks
-        return similarities, masks
+        return masked_cosine_sim(normalize_rows(sent_list1_matrix), sent_list1_mask,
+                                 normalize_rows(sent_list2_matrix), sent_list2_mask)
+
+    def get_label_matrix_and_mask(self, descriptions: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        得到一组标签描述按行归一化后的句向量矩阵以及mask，结果会被缓存
+        :param descriptions: List[str]型，标签的描述（例如BaseLabel中的descriptions）
+        """
+        key = tuple(descriptions)
+        cached = self.label_cache.get(key)
+        if cached is None:
+            desc_matrix, desc_mask = self._get_matrix_and_mask(descriptions)
+            cached = (normalize_rows(desc_matrix), desc_mask)
+            self.label_cache[key] = cached
+        return cached
+
+    def label_sim(self,
+                  descriptions: List[str],
+                  sent_list: Union[List[str], List[List[str]]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        和sentlist_sim(descriptions, sent_list)的结果相同，但是标签描述一侧使用缓存的矩阵
+        """
+        desc_matrix, desc_mask = self.get_label_matrix_and_mask(descriptions)
+        sent_matrix, sent_mask = self._get_matrix_and_mask(sent_list)
+        return masked_cosine_sim(desc_matrix, desc_mask,
+                                 normalize_rows(sent_matrix), sent_mask)
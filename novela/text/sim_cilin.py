@@ -1,40 +1,176 @@
 # coding=utf-8
 # @Author: 莫冉
 # @Date: 2021-01-29
-from typing import Dict, List, Tuple
+import os
+import gc
+import pickle
+import hashlib
+from typing import Dict, List, Tuple, Sequence, Optional
 import numpy as np
 import math
-import jieba
-from functools import lru_cache
 
 from novela import logger
+import novela.constants as constants
+from novela.utils.segment_cache import cached_cut
 
 
 logger = logger.getChild("cilin")
 
 
+# 词林编码的各层在编码中的位置：大类、中类、小类、词群、原子词群以及标记位
+CODE_LEVEL_SLICES = [(0, 1), (1, 2), (2, 4), (4, 5), (5, 7), (7, 8)]
+# 公共层数为k时，对应的公共编码的长度
+CODE_PREFIX_LENS = [0, 1, 2, 4, 5, 7, 8]
+# 词林快照的版本号，快照中保存的内容发生变化时需要增加
+SNAPSHOT_VERSION = 1
+
+
+def _segment_reduce(ufunc: np.ufunc, matrix: np.ndarray, counts: np.ndarray):
+    """
+    对矩阵中连续分段的行进行规约，counts表示每一段的行数（都大于0）
+    这里按照每一行在段内的位置逐层规约，循环次数只取决于最长的分段
+    """
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    reduced = matrix[starts].copy()
+    for rank in range(1, int(counts.max())):
+        segments = np.nonzero(counts > rank)[0]
+        reduced[segments] = ufunc(reduced[segments], matrix[starts[segments] + rank])
+    return reduced
+
+
 class CilinSimilarity(object):
     """
     @desc:使用基于信息内容的算法来计算词语相似度。参考文献：
     【1】彭琦, 朱新华, 陈意山,等. 基于信息内容的词林词语相似度计算[J]. 计算-机应用研究, 2018(2):400-404.
     """
-    def __init__(self, cilin_file: str = "../../data/resources/new_cilin.txt"):
+    def __init__(self,
+                 cilin_file: str = "../../data/resources/new_cilin.txt",
+                 snapshot_dir: Optional[str] = constants.CACHE_PATH):
+        """
+        :param cilin_file: str型，表示词林文件的路径
+        :param snapshot_dir: str型（可选），表示保存统计结果快照的目录，为None时不使用快照
+        """
         self.code_word: Dict[str, List[str]] = {}      # 以编码为key，单词list为value的dict，一个编码有多个单词
         self.word_code: Dict[str, List[str]] = {}      # 以单词为key，编码为value的dict，一个单词可能有多个编码
         self.vocab = set()                             # 所有不重复的单词，便于统计词汇总数
         self.file = cilin_file                         # 表示词林文件的路径
+        self.snapshot_dir = snapshot_dir               # 表示快照所在的目录
         self.mydict: Dict[str, int] = {}                               # 每一个大中小类编码对应的下位节点数量
-        # 读取文件并进行统计
-        self._read_cilin()
-        # 计算总的节点数
-        total = 0
-        for ele in self.mydict:
-            if len(ele) == 1:
-                total += self.mydict[ele]
-
-        logger.info(f"词林的总节点数为: {total}")
-        # 得到计算信息内容含量时的分母
-        self.fenmu = math.log(total, 2)
+        self.fenmu = 0.0                                               # 计算信息内容含量时的分母
+        self.info_content: Dict[str, float] = {}                       # 每一个大中小类编码的信息内容含量
+        # 整数化之后的编码（在统计完成之后构造）
+        self.codes: List[str] = []                                     # 所有的编码
+        self.code_levels = np.zeros((0, len(CODE_LEVEL_SLICES)), dtype=np.int32)   # 每个编码各层前缀的整数编号，0表示该层不存在
+        self.code_prefix_ic = np.zeros((0, len(CODE_PREFIX_LENS)))     # 每个编码前k层公共编码的信息内容含量
+        self.code_self_ic = np.zeros(0)                                # 每个编码自身的信息内容含量
+        # 单词到编码编号的映射，第i个单词的编码编号为word_code_flat[word_code_offsets[i]:word_code_offsets[i+1]]
+        self.word_index: Dict[str, int] = {}
+        self.word_code_offsets = np.zeros(1, dtype=np.int64)
+        self.word_code_flat = np.zeros(0, dtype=np.int64)
+        # 优先加载快照，快照不存在或者已经过期时读取文件并进行统计
+        if not self._load_snapshot():
+            self._read_cilin()
+            # 计算总的节点数
+            total = 0
+            for ele in self.mydict:
+                if len(ele) == 1:
+                    total += self.mydict[ele]
+
+            logger.info(f"词林的总节点数为: {total}")
+            # 得到计算信息内容含量时的分母
+            self.fenmu = math.log(total, 2)
+            # 预先计算每个节点的信息内容含量，并将编码转化为整数
+            self._build_code_arrays()
+            self._save_snapshot()
+
+    def _snapshot_file(self) -> str:
+        return os.path.join(self.snapshot_dir, f"{os.path.basename(self.file)}.snapshot.pkl")
+
+    def _snapshot_key(self) -> Dict[str, object]:
+        """快照的键，由快照版本、词林文件的修改时间、大小以及内容的哈希值组成"""
+        stat = os.stat(self.file)
+        with open(self.file, "rb") as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+        return {"version": SNAPSHOT_VERSION, "mtime": stat.st_mtime_ns, "size": stat.st_size, "sha1": sha1}
+
+    def _load_snapshot(self) -> bool:
+        """如果存在和当前词林文件一致的快照，则直接加载"""
+        if self.snapshot_dir is None or not os.path.isfile(self._snapshot_file()):
+            return False
+        gc_enabled = gc.isenabled()
+        try:
+            # 反序列化大量的小对象时暂停垃圾回收
+            gc.disable()
+            with open(self._snapshot_file(), "rb") as f:
+                snapshot = pickle.load(f)
+            if snapshot.get("key") != self._snapshot_key():
+                logger.info("词林文件已经发生变化，重新统计。")
+                return False
+        except Exception as e:
+            logger.warning(f"加载词林快照出错!@{e}")
+            return False
+        finally:
+            if gc_enabled:
+                gc.enable()
+        for attr, value in snapshot["data"].items():
+            setattr(self, attr, value)
+        self.vocab = set(self.word_code)
+        logger.info(f"从{self._snapshot_file()}加载词林快照。")
+        return True
+
+    def _save_snapshot(self):
+        """将统计结果保存为快照，之后构造时直接加载"""
+        if self.snapshot_dir is None:
+            return
+        attrs = ["code_word", "word_code", "mydict", "fenmu", "info_content", "codes", "code_levels",
+                 "code_prefix_ic", "code_self_ic", "word_index", "word_code_offsets", "word_code_flat"]
+        snapshot = {"key": self._snapshot_key(),
+                    "data": {attr: getattr(self, attr) for attr in attrs}}
+        try:
+            if not os.path.isdir(self.snapshot_dir):
+                os.makedirs(self.snapshot_dir)
+            tmp_file = self._snapshot_file() + ".tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self._snapshot_file())
+        except OSError as e:
+            logger.warning(f"保存词林快照出错!@{e}")
+
+    def _build_code_arrays(self):
+        """计算mydict中每个节点的信息内容含量，并将每个编码按层转化为定长的整数数组"""
+        for concept, hypo in self.mydict.items():
+            self.info_content[concept] = 1 - math.log(hypo + 1, 2) / self.fenmu
+
+        self.codes = list(self.code_word.keys())
+        code_index = {code: i for i, code in enumerate(self.codes)}
+        # 每一层用截止到该层的编码前缀进行编号，因此某一层相同就意味着之前的所有层都相同
+        level_ids: List[Dict[str, int]] = [{} for _ in CODE_LEVEL_SLICES]
+        self.code_levels = np.zeros((len(self.codes), len(CODE_LEVEL_SLICES)), dtype=np.int32)
+        self.code_prefix_ic = np.zeros((len(self.codes), len(CODE_PREFIX_LENS)))
+        self.code_self_ic = np.zeros(len(self.codes))
+        for i, code in enumerate(self.codes):
+            for level, (start, end) in enumerate(CODE_LEVEL_SLICES):
+                if len(code) > start:
+                    prefix = code[:end]
+                    self.code_levels[i, level] = level_ids[level].setdefault(prefix, len(level_ids[level]) + 1)
+            for k, prefix_len in enumerate(CODE_PREFIX_LENS):
+                self.code_prefix_ic[i, k] = self.Info_Content(code[:prefix_len])
+            self.code_self_ic[i] = self.Info_Content(code)
+
+        self.word_index = {word: i for i, word in enumerate(self.word_code)}
+        counts = [len(codes) for codes in self.word_code.values()]
+        self.word_code_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.word_code_flat = np.asarray([code_index[code] for codes in self.word_code.values() for code in codes],
+                                         dtype=np.int64)
+
+    def _gather_word_codes(self, words: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """得到多个单词的所有编码编号（按单词顺序拼接）以及每个单词的编码数量"""
+        word_ids = np.asarray([self.word_index[w] for w in words], dtype=np.int64)
+        starts = self.word_code_offsets[word_ids]
+        counts = self.word_code_offsets[word_ids + 1] - starts
+        # 每个编码在所属单词中的位置
+        ranks = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.word_code_flat[np.repeat(starts, counts) + ranks], counts
 
     def _read_cilin(self):
         """
@@ -44,6 +180,7 @@ class CilinSimilarity(object):
         :return:
         """
         head = set()
+        counts: Dict[str, int] = {}
         with open(self.file, "r", encoding="gbk") as f:
             for line in f:
                 line = line.strip()
@@ -62,32 +199,27 @@ class CilinSimilarity(object):
                         # 否则，则在字典中添加该项
                         self.word_code[w] = [code]
 
-                # 第一次遍历：得到大中小类的代码
+                # 统计各个上位编码包含的单词数量
+                prefixes = []
+                if len(code) > 5:
+                    prefixes.extend([code[:7], code[:5]])
+                if len(code) > 4:
+                    prefixes.append(code[:4])
+                if len(code) > 2:
+                    prefixes.append(code[:2])
+                if len(code) > 1:
+                    prefixes.append(code[:1])
+                for prefix in prefixes:
+                    counts[prefix] = counts.get(prefix, 0) + len(words)
+
+                # 得到大中小类的代码
                 if len(code) < 6:
                     continue
                 fathers = [code[:1], code[:2], code[:4], code[:5], code[:7]]
                 head.update(fathers)
-        # 得到排序之后的大中小类代码
-        fatherlist = sorted(list(head))
-        for ele in fatherlist:
-            self.mydict[ele] = 0
-
-        # 第二次遍历：得到大中小类的数量，更新到mydict中
-        with open(self.file, "r", encoding="gbk") as f:
-            for line in f:
-                line = line.strip()
-                res = line.split()
-                code = res[0]      # 单词编码
-                words = res[1:]    # 编码对应的单词列表
-                if len(code) > 5 and code[:5] in self.mydict:
-                    self.mydict[code[:7]] += len(words)
-                    self.mydict[code[:5]] += len(words)
-                if len(code) > 4 and code[:4] in self.mydict:
-                    self.mydict[code[:4]] += len(words)
-                if len(code) > 2 and code[:2] in self.mydict:
-                    self.mydict[code[:2]] += len(words)
-                if len(code) > 1 and code[:1] in self.mydict:
-                    self.mydict[code[:1]] += len(words)
+        # 只保留大中小类的代码，得到排序之后的下位节点数量
+        for ele in sorted(head):
+            self.mydict[ele] = counts.get(ele, 0)
 
     def get_common_str(self, c1: str, c2: str):
         """
@@ -105,7 +237,6 @@ class CilinSimilarity(object):
             res = res[:-1]
         return res
 
-    @lru_cache(maxsize=32)
     def Info_Content(self, concept: str):
         """
         计算一个编码的信息内容含量
@@ -114,13 +245,9 @@ class CilinSimilarity(object):
         if concept == "":
             return 0
 
-        # 计算当前编码的下位节点数
-        hypo = 1
-        if concept in self.mydict:
-            hypo += self.mydict[concept]
-        info = math.log(hypo, 2) / self.fenmu
         # 下位节点数越多，信息含量越少；下位节点数越少，信息含量越高
-        return 1 - info
+        # 不在mydict中的编码没有下位节点，信息含量为1
+        return self.info_content.get(concept, 1.0)
 
     def sim_by_IC(self, c1: str, c2: str):
         # 找到公共字符串
@@ -158,36 +285,77 @@ class CilinSimilarity(object):
         else:
             return min(simlist)
 
-    def wordlist_sim(self, word_list1: List[str], word_list2: List[str]) -> Tuple[np.ndarray, np.ndarray]:
-        similarities, masks = [], []
+    def code_sim_matrix(self, code_ids1: Sequence[int], code_ids2: Sequence[int]) -> np.ndarray:
+        """
+        批量计算两组编码之间的相似度，结果和sim_by_IC一致
+        :param code_ids1: 编码在self.codes中的编号，长度为n
+        :param code_ids2: 编码在self.codes中的编号，长度为m
+        :return: [n, m]的相似度矩阵
+        """
+        code_ids1 = np.asarray(code_ids1, dtype=np.int64)
+        code_ids2 = np.asarray(code_ids2, dtype=np.int64)
+        levels1 = self.code_levels[code_ids1].T
+        # 第二组中不存在的层记为-1，保证不会和第一组中不存在的层（0）相等
+        levels2 = np.where(self.code_levels[code_ids2] > 0, self.code_levels[code_ids2], -1).T
+        # 相同的层数即公共编码的层数
+        common = np.zeros((len(code_ids1), len(code_ids2)), dtype=np.int8)
+        for level1, level2 in zip(levels1, levels2):
+            common += level1[:, None] == level2[None, :]
+        lcs_ic = self.code_prefix_ic[code_ids1[:, None], common]
+        distance = lcs_ic - (self.code_self_ic[code_ids1][:, None] + self.code_self_ic[code_ids2][None, :]) / 2
+        return distance + 1
 
+    def word_sim_matrix(self, word_list1: List[str], word_list2: List[str]) -> np.ndarray:
+        """
+        批量计算两个单词列表中单词之间的相似度，结果和word_sim一致
+        :return: [len(word_list1), len(word_list2)]的相似度矩阵，-1.0表示有单词在词表中不存在
+        """
+        similarities = np.full((len(word_list1), len(word_list2)), -1.0)
+        rows = [i for i, w in enumerate(word_list1) if w in self.word_index]
+        cols = [j for j, w in enumerate(word_list2) if w in self.word_index]
+        if not rows or not cols:
+            return similarities
+
+        # 将所有单词的编码拼接起来，每个单词对应其中连续的一段
+        codes1, counts1 = self._gather_word_codes([word_list1[i] for i in rows])
+        codes2, counts2 = self._gather_word_codes([word_list2[j] for j in cols])
+        code_sims = self.code_sim_matrix(codes1, codes2)
+
+        # 按照单词分段求和、最大值以及最小值（先规约行，再规约列）
+        sims_t = {}
+        for name, ufunc in [("sum", np.add), ("max", np.maximum), ("min", np.minimum)]:
+            reduced = _segment_reduce(ufunc, code_sims, counts1)
+            sims_t[name] = _segment_reduce(ufunc, np.ascontiguousarray(reduced.T), counts2).T
+        sim_sum, sim_max, sim_min = sims_t["sum"], sims_t["max"], sims_t["min"]
+        counts = counts1[:, None] * counts2[None, :]
+        average = sim_sum / counts
+
+        # 按照word_sim中的规则得到相似度
+        sims = np.where(sim_max > 0.7, sim_max,
+                        np.where(average > 0.2, (sim_sum - sim_max) / np.maximum(counts - 1, 1), sim_min))
+        sims = np.where(counts < 2, sim_sum, sims)
+        similarities[np.ix_(rows, cols)] = sims
+        return similarities
+
+    def wordlist_sim(self, word_list1: List[str], word_list2: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # 由于有的标签的中文单词很长
+        # 所以需要分割，并取各个部分相似度的最大值
+        pieces, starts = [], []
         for w1 in word_list1:
-            sims = []
-            mask = []
             if w1.endswith("类"):
                 w1 = w1[:-1]
-            # 由于有的标签的中文单词很长
-            # 所以需要分割分别判断
-            w1_list = jieba.lcut(w1)
-            for w2 in word_list2:
-                sim_list = []
-                for w in w1_list:
-                    sim_list.append(self.word_sim(w, w2))
-                if len(sim_list) == 1:
-                    sim = sim_list[0]
-                else:
-                    sim = max(sim_list)
-                if sim == -1.0:
-                    mask.append(0.0)
-                else:
-                    mask.append(1.0)
-                sims.append(sim)
-
-            similarities.append(sims)
-            masks.append(mask)
-
-        return np.asarray(similarities), np.asarray(masks)
+            starts.append(len(pieces))
+            pieces.extend(cached_cut(w1))
+        counts = np.diff(starts + [len(pieces)])
+
+        similarities = np.full((len(word_list1), len(word_list2)), -1.0)
+        valid = counts > 0
+        if pieces and len(word_list2) > 0:
+            piece_sims = self.word_sim_matrix(pieces, word_list2)
+            similarities[valid] = np.maximum.reduceat(piece_sims, np.asarray(starts)[valid], axis=0)
+        masks = (similarities != -1.0).astype(float)
 
+        return similarities, masks
 
 
 if __name__ == '__main__':
@@ -1,13 +1,12 @@
 # coding=utf-8
 # @Author: 莫冉
 # @Date: 2021-02-01
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Sequence
 import math
-import jieba
 import numpy as np
-from functools import lru_cache
 
 from novela import logger
+from novela.utils.segment_cache import cached_cut
 
 
 logger = logger.getChild("hownet")
@@ -148,15 +147,6 @@ class SememeElement:
         return False
 
 
-def valuesOfGlossaryTable(glossary_table: Dict[str, GlossaryElement], word: str):
-    values = []
-    for k, v in glossary_table.items():
-        k = k.split("_")[1]
-        if k == word:
-            values.append(v)
-    return values
-
-
 class HowNetSimilarity:
     """
     基于知网义项树路径的单词相似度
@@ -167,10 +157,19 @@ class HowNetSimilarity:
         self.sememe_table = dict()        # 义原表
         self.sememeindex_zh = dict()      # 义原索引（中文）
         self.glossary_table = dict()       # 词汇表
+        self.glossary_index = dict()       # 单词到词汇表中所有项的索引
         # 文件路径
         self.glossary_file = glossary_file
         self.sememe_file = sememe_file
         self.vocab = set()       # 保存所有单词
+        # 义原树的预计算结果（加载义原表之后计算）
+        self.sememe_ancestors: Dict[int, List[int]] = dict()        # 每个义原到根节点的路径（包括自身）
+        self._ancestor_pos: Dict[int, Dict[int, int]] = dict()      # 路径中每个祖先节点在路径中的位置
+        self._sememe_rows = np.zeros(0, dtype=np.int64)             # 义原编号到祖先矩阵行号的映射
+        self._ancestor_matrix = np.zeros((0, 0), dtype=np.int64)    # 祖先矩阵，不足的位置用-1填充
+        self.sememe_depth = np.zeros(0, dtype=np.int64)             # 每个义原的深度
+        self._weights = np.zeros(0)                                 # weight(i)的查找表
+        self._steps = np.zeros(0)                                   # 向上追溯k步时累加的距离
         self.BETA = [0.5, 0.2, 0.17, 0.13]
         self.GAMA = 0.2
         self.DELTA = 0.2
@@ -181,6 +180,7 @@ class HowNetSimilarity:
         if not self._load_sememe_table(self.sememe_file):
             logger.error(f"`{self.sememe_file}`文件加载失败！")
             return False
+        self._build_sememe_ancestors()
         if not self._load_glossary(self.glossary_file):
             logger.error(f"`{self.glossary_file}`文件加载失败！")
             return False
@@ -216,6 +216,7 @@ class HowNetSimilarity:
                         ele = GlossaryElement()
                         if ele.parse(line):
                             self.glossary_table[f"{count}_{ele.word}"] = ele
+                            self.glossary_index.setdefault(ele.word, []).append(ele)
                             self.vocab.add(ele.word)
                             count += 1
                 logger.info("Load glossary file successfully!")
@@ -237,18 +238,62 @@ class HowNetSimilarity:
             return self.sememeindex_zh[word]
         return None
 
-    @lru_cache(maxsize=64)
     def getGlossaryByWord(self, word: str):
         """根据单词获取词汇表中的项"""
-        if word in self.vocab:
-            return valuesOfGlossaryTable(self.glossary_table, word)
-        return None
-
-    def weight(self, index: int):
+        return self.glossary_index.get(word)
+
+    def _build_sememe_ancestors(self):
+        """预先计算每个义原到根节点的路径、深度以及距离的权重表"""
+        for sememe_id, sememe in self.sememe_table.items():
+            path = []
+            id_, father = sememe_id, sememe.father
+            # 追溯上位义原，直到根节点（父节点是自身）或者父节点不存在
+            while id_ != father and id_ not in path:
+                path.append(id_)
+                id_ = father
+                father_ = self.getSememeByID(father)
+                if father_:
+                    father = father_.father
+            path.append(id_)
+            self.sememe_ancestors[sememe_id] = path
+            self._ancestor_pos[sememe_id] = {ancestor: pos for pos, ancestor in enumerate(path)}
+
+        max_len = max([len(path) for path in self.sememe_ancestors.values()], default=0)
+        max_id = max(self.sememe_ancestors.keys(), default=-1)
+        self._sememe_rows = np.full(max_id + 1, -1, dtype=np.int64)
+        self._ancestor_matrix = np.full((len(self.sememe_ancestors), max_len), -1, dtype=np.int64)
+        self.sememe_depth = np.zeros(len(self.sememe_ancestors), dtype=np.int64)
+        for row, (sememe_id, path) in enumerate(self.sememe_ancestors.items()):
+            self._sememe_rows[sememe_id] = row
+            self._ancestor_matrix[row, :len(path)] = path
+            self.sememe_depth[row] = len(path) - 1
+
+        # 距离 = weight(祖先在第一条路径中的位置) + 第二条路径向上追溯的步数 * weight(1)
+        self._weights = np.array([self._calc_weight(i) for i in range(max_len)])
+        steps = [0.0]
+        for _ in range(1, max_len):
+            steps.append(steps[-1] + self._calc_weight(1))
+        self._steps = np.array(steps)
+
+    @staticmethod
+    def _calc_weight(index: int):
         left = 1 - index / 13
         right = 1 + math.sin(index * math.pi / 45)
         return left * right
 
+    def weight(self, index: int):
+        if 0 <= index < len(self._weights):
+            return self._weights[index]
+        return self._calc_weight(index)
+
+    def _sememe_distance(self, id1: int, id2: int):
+        """根据预计算的路径得到两个义原之间的距离，即最近公共祖先的查找"""
+        father_pos = self._ancestor_pos[id1]
+        for k, ancestor in enumerate(self.sememe_ancestors[id2]):
+            if ancestor in father_pos:
+                return self._weights[father_pos[ancestor]] + self._steps[k]
+        return 20.0
+
     def calcSememeDistance(self, w1: str, w2: str):
         """计算义原之间的距离（即义原树中两个节点之间的距离）"""
         s1 = self.getSememeByWord(w1)
@@ -257,37 +302,49 @@ class HowNetSimilarity:
         if s1 is None or s2 is None:
             return -1.0
 
-        father_path = []
-
-        id1, id2 = s1.id, s2.id
-        father1, father2 = s1.father, s2.father
-
-        # 追溯s1的上位词
-        while (id1 != father1):
-            father_path.append(id1)
-            id1 = father1
-            father_ = self.getSememeByID(father1)
-            if father_:
-                father1 = father_.father
-
-        father_path.append(id1)
-        # 计算距离的权重
-        len_ = 0.0
-        while (id2 != father2):
-            if id2 in father_path:
-                father_pos = father_path.index(id2)
-                return self.weight(father_pos) + len_
-
-            id2 = father2
-            father_ = self.getSememeByID(father2)
-            if father_:
-                father2 = father_.father
-            len_ = len_ + self.weight(1)
-
-        if id2 in father_path:
-            father_pos = father_path.index(id2)
-            return self.weight(father_pos) + len_
-        return 20.0
+        return self._sememe_distance(s1.id, s2.id)
+
+    def getSememeIDs(self, words: Sequence[str]) -> np.ndarray:
+        """将多个义原名称转化为义原编号，不存在的义原编号为-1"""
+        ids = []
+        for word in words:
+            sememe = self.getSememeByWord(word)
+            ids.append(-1 if sememe is None else sememe.id)
+        return np.asarray(ids, dtype=np.int64)
+
+    def sememe_sim_matrix(self, ids_a: Sequence[int], ids_b: Sequence[int]) -> np.ndarray:
+        """
+        批量计算两组义原之间的相似度，结果与calcSememeSim一致
+        :param ids_a: 义原编号的序列，长度为n
+        :param ids_b: 义原编号的序列，长度为m
+        :return: [n, m]的相似度矩阵，存在不合法义原编号的位置为-1
+        """
+        ids_a = np.asarray(ids_a, dtype=np.int64).reshape(-1)
+        ids_b = np.asarray(ids_b, dtype=np.int64).reshape(-1)
+        rows_a = self._lookup_rows(ids_a)
+        rows_b = self._lookup_rows(ids_b)
+        path_a = self._ancestor_matrix[np.maximum(rows_a, 0)]      # [n, L]
+        path_b = self._ancestor_matrix[np.maximum(rows_b, 0)]      # [m, L]
+
+        # match[i, j, p, k]表示第一条路径的第p个节点和第二条路径的第k个节点相同
+        match = (path_a[:, None, :, None] == path_b[None, :, None, :]) & (path_a[:, None, :, None] >= 0)
+        found = match.any(axis=2)                                  # [n, m, L]
+        has_common = found.any(axis=-1)
+        # 第二条路径中第一个出现在第一条路径中的节点，即最近公共祖先
+        k = found.argmax(axis=-1)
+        pos = np.take_along_axis(match, k[:, :, None, None], axis=3)[..., 0].argmax(axis=-1)
+        distance = np.where(has_common, self._weights[pos] + self._steps[k], 20.0)
+
+        sims = self.ALFA / (self.ALFA + distance)
+        sims[ids_a[:, None] == ids_b[None, :]] = 1.0
+        sims[(rows_a[:, None] < 0) | (rows_b[None, :] < 0)] = -1.0
+        return sims
+
+    def _lookup_rows(self, ids: np.ndarray) -> np.ndarray:
+        valid = (ids >= 0) & (ids < len(self._sememe_rows))
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        rows[valid] = self._sememe_rows[ids[valid]]
+        return rows
 
     def calcSememeSim(self, w1: str, w2: str):
         """计算两个单词在义原树上的相似度"""
@@ -448,7 +505,7 @@ class HowNetSimilarity:
                 w1 = w1[:-1]
             # 由于有的标签的中文单词很长
             # 所以需要分割分别判断
-            w1_list = jieba.lcut(w1)
+            w1_list = cached_cut(w1)
             for w2 in word_list2:
                 sim_list = []
                 for w in w1_list:
@@ -1,29 +1,175 @@
 # coding=utf-8
 # @Author: 莫冉
 # @Date: 2021-02-03
-from typing import Dict, List, Union, Tuple
-import jieba
+import os
+import sys
+import bz2
+from typing import Dict, List, Union, Tuple, Iterable, TYPE_CHECKING
 import numpy as np
-from gensim.models.keyedvectors import KeyedVectors
-from gensim.models.word2vec import Word2VecKeyedVectors
-from sklearn.metrics.pairwise import cosine_similarity
 
 from novela import logger
+from novela._utils.imports import LazyObject
+from novela.utils.segment_cache import cached_cut
+
+if TYPE_CHECKING:
+    # 只用于类型注解，运行时不导入gensim
+    from gensim.models.word2vec import Word2VecKeyedVectors
 
 
 logger = logger.getChild("word2vector")
 
+# gensim的导入比较耗时，只有使用gensim加载词向量文件时才导入
+KeyedVectors = LazyObject("gensim.models.keyedvectors.KeyedVectors")
+
+
+# 编译后的词向量目录中包含的两个文件
+VOCAB_FILE = "vocab.txt"          # 每行一个单词，行号即为该单词在矩阵中的索引
+VECTORS_FILE = "vectors.npy"      # float32的词向量矩阵，维度为 [vocab_size, vector_size]
+
+
+class MemmapWordVectors:
+    """
+    编译之后的词向量，词向量矩阵通过np.memmap只读映射到内存中
+    这样加载只需要读取词表，并且多个进程可以共享同一份内存页
+    """
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, VOCAB_FILE), "r", encoding="utf-8") as f:
+            words = f.read().split("\n")
+        self.vocab: Dict[str, int] = {word: i for i, word in enumerate(words)}
+        self.vectors: np.ndarray = np.load(os.path.join(store_dir, VECTORS_FILE), mmap_mode="r")
+        self.vector_size = self.vectors.shape[1]
+
+    def __getitem__(self, word: str) -> np.ndarray:
+        return self.vectors[self.vocab[word]]
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.vocab
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def keys(self) -> Iterable[str]:
+        return self.vocab.keys()
+
+
+def is_compiled_wordvectors(path: str) -> bool:
+    """判断路径是否是compile_wordvectors编译得到的词向量目录"""
+    return os.path.isdir(path) and \
+        os.path.isfile(os.path.join(path, VOCAB_FILE)) and \
+        os.path.isfile(os.path.join(path, VECTORS_FILE))
+
+
+def compile_wordvectors(w2v_file: str, store_dir: str) -> str:
+    """
+    将文本格式的词向量文件（可以是.bz2压缩文件）编译为词表文件以及连续的float32矩阵，只需要执行一次
+    :param w2v_file: str型，表示原始的词向量文件
+    :param store_dir: str型，表示编译结果保存的目录
+    :return: 编译结果所在的目录
+    """
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    vocab_file = os.path.join(store_dir, VOCAB_FILE)
+    vectors_file = os.path.join(store_dir, VECTORS_FILE)
+    tmp_file = vectors_file + ".tmp.npy"
+
+    open_func = bz2.open if w2v_file.endswith(".bz2") else open
+    words: List[str] = []
+    seen = set()
+    rows: List[np.ndarray] = []     # 没有表头时先暂存每一行
+    matrix = None                   # 有表头时直接写入预先分配的memmap
+    vector_size = 0
+    with open_func(w2v_file, "rt", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            line = line.rstrip()
+            # 第一行可能是表示词表大小和向量大小的标志
+            if i == 0:
+                line_list = line.split()
+                if len(line_list) == 2:
+                    vector_size = int(line_list[1])
+                    matrix = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.float32,
+                                                       shape=(int(line_list[0]), vector_size))
+                    continue
+            if not line:
+                continue
+            word, vector_string = line.split(" ", 1)
+            vector = np.asarray(vector_string.split(), dtype=np.float32)
+            if vector_size == 0:
+                vector_size = len(vector)
+            # 跳过重复的单词以及维度不正确的行
+            if word in seen or len(vector) != vector_size:
+                logger.warning(f"跳过词向量文件第{i + 1}行的单词`{word}`。")
+                continue
+            if matrix is not None:
+                if len(words) >= matrix.shape[0]:
+                    logger.warning(f"词向量文件的行数超过了表头中的词表大小，忽略第{i + 1}行之后的内容。")
+                    break
+                matrix[len(words)] = vector
+            else:
+                rows.append(vector)
+            seen.add(word)
+            words.append(word)
+
+    if matrix is None:
+        np.save(tmp_file, np.asarray(rows, dtype=np.float32).reshape(len(words), vector_size))
+    elif len(words) < matrix.shape[0]:
+        # 表头中的词表大小与实际的单词数不一致时截断
+        np.save(vectors_file + ".trunc.npy", matrix[:len(words)])
+        del matrix
+        os.replace(vectors_file + ".trunc.npy", tmp_file)
+    else:
+        matrix.flush()
+        del matrix
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(words))
+    os.replace(tmp_file, vectors_file)
+    logger.info(f"词向量编译完成，共包含单词{len(words)}个，词向量长度为{vector_size}，保存在{store_dir}。")
+    return store_dir
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """将矩阵的每一行归一化为单位向量（全零的行保持不变）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return matrix / norms
+
+
+def masked_cosine_sim(matrix1: np.ndarray, mask1: np.ndarray,
+                      matrix2: np.ndarray, mask2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算两个已经按行归一化的矩阵之间的余弦相似度，并归一化到[0, 1]之间
+    :return: 相似度矩阵和mask矩阵，维度均为 [matrix1_len, matrix2_len]
+    """
+    # 维度为 matrix1_len * matrix2_len
+    similarities = np.matmul(matrix1, matrix2.T)
+    # 余弦相似度范围在[-1, 1]之间，这里归一化到[0, 1]之间
+    similarities = (similarities + 1) / 2
+
+    m1_expand = np.expand_dims(mask1, axis=1).astype(np.int8)
+    m2_expand = np.expand_dims(mask2, axis=0).astype(np.int8)
+    masks = (m1_expand & m2_expand).astype(np.float16)
+
+    # 分别乘以两个列表的mask向量
+    similarities = similarities * masks
+    return similarities, masks
+
+
+def _is_gensim_wordvectors(word2vec) -> bool:
+    """判断是否为gensim的词向量对象，gensim还没有导入时不可能是gensim的对象，也就不需要导入"""
+    keyedvectors = sys.modules.get("gensim.models.keyedvectors")
+    return keyedvectors is not None and isinstance(word2vec, keyedvectors.Word2VecKeyedVectors)
+
 
 class WordVectorSimilarity:
     def __init__(self,
                  w2v_file: str = None,
-                 word2vec: Union[Word2VecKeyedVectors, Dict[str, np.ndarray]] = None):
+                 word2vec: Union["Word2VecKeyedVectors", Dict[str, np.ndarray]] = None):
         if w2v_file is None and word2vec is None:
             raise ValueError(f"`w2v_file` and `word2vec` can both be None.")
         # 是否提供了词向量对象
         if word2vec is not None:
             self.word2vec = word2vec
-            if isinstance(word2vec, Word2VecKeyedVectors):
+            if isinstance(word2vec, MemmapWordVectors) or _is_gensim_wordvectors(word2vec):
                 self.vocab_size = len(self.word2vec.vocab)
                 self.vector_size = self.word2vec.vector_size
             else:
@@ -32,9 +178,17 @@ class WordVectorSimilarity:
         else:
             # 加载词向量
             self._load_wordvectors(w2v_file)
+        # 标签一侧归一化后的矩阵和mask，键为标签名称组成的tuple
+        self.label_cache: Dict[Tuple[str, ...], Tuple[np.ndarray, np.ndarray]] = {}
         logger.info(f"加载了词向量共包含单词{self.vocab_size}个，词向量长度为{self.vector_size}。")
 
     def _load_wordvectors(self, w2v_file: str):
+        # 如果是已经编译好的词向量目录，则直接映射到内存
+        if is_compiled_wordvectors(w2v_file):
+            self.word2vec = MemmapWordVectors(w2v_file)
+            self.vocab_size = len(self.word2vec)
+            self.vector_size = self.word2vec.vector_size
+            return
         try:
             self.word2vec = KeyedVectors.load_word2vec_format(w2v_file)
             self.vocab_size = len(self.word2vec.vocab)
@@ -71,7 +225,7 @@ class WordVectorSimilarity:
             if is_cut:
                 w_list = [word]
             else:
-                w_list = jieba.cut(word)
+                w_list = cached_cut(word)
             # 对于有的标签单词比较长的情况
             # 需要在切分成一个一个的单词
             vec = np.zeros(self.vector_size)
@@ -135,23 +289,42 @@ class WordVectorSimilarity:
         word_list1_matrix, word_list1_mask = self._get_matrix_and_mask(word_list1, is_cut=False)
         word_list2_matrix, word_list2_mask = self._get_matrix_and_mask(word_list2, is_cut=True)
 
-        # 使用cosine_similarity计算相似度
-        # 维度为 word_list1_len * word_list2_len
-        similarities = cosine_similarity(word_list1_matrix, word_list2_matrix)
-
-        # 余弦相似度范围在[-1, 1]之间，这里归一化到[0, 1]之间
-        similarities = (similarities + 1) / 2
-
-        w1_expand = np.expand_dims(word_list1_mask, axis=1).astype(np.int8)
-        w2_expand = np.expand_dims(word_list2_mask, axis=0).astype(np.int8)
-
+        return masked_cosine_sim(normalize_rows(word_list1_matrix), word_list1_mask,
+                                 normalize_rows(word_list2_matrix), word_list2_mask)
 
-        masks = (w1_expand & w2_expand).astype(np.float16)
+    def get_label_matrix_and_mask(self, label_names: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        得到一组标签名称按行归一化后的词向量矩阵以及mask，结果会被缓存
+        :param label_names: List[str]型，标签的名称（例如BaseLabel中的display_names）
+        """
+        key = tuple(label_names)
+        cached = self.label_cache.get(key)
+        if cached is None:
+            label_matrix, label_mask = self._get_matrix_and_mask(label_names, is_cut=False)
+            cached = (normalize_rows(label_matrix), label_mask)
+            self.label_cache[key] = cached
+        return cached
 
-        # 分别乘以word_list1和word_list2的mask向量
-        similarities = similarities * masks
+    def label_sim(self, label_names: List[str], word_list: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        和wordlist_sim(label_names, word_list)的结果相同，但是标签一侧使用缓存的矩阵
+        """
+        if label_names == word_list:
+            return self.wordlist_sim(label_names, word_list)
+        label_matrix, label_mask = self.get_label_matrix_and_mask(label_names)
+        word_matrix, word_mask = self._get_matrix_and_mask(word_list, is_cut=True)
+        return masked_cosine_sim(label_matrix, label_mask,
+                                 normalize_rows(word_matrix), word_mask)
 
-        return similarities, masks
 
+if __name__ == '__main__':
+    import argparse
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--w2v_file", default="/home/models/wordvector/sgns.literature.word.bz2", type=str,
+                        help="The path of word2vector file.")
+    parser.add_argument("--to_dir", default="/home/models/wordvector/sgns.literature.word", type=str,
+                        help="The directory of the compiled word2vector.")
+    args = parser.parse_args()
 
+    compile_wordvectors(args.w2v_file, args.to_dir)
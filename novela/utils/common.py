@@ -3,30 +3,53 @@
 # @Date: 2021-01-05
 import os
 import re
-import docx
 import string
-import jieba
 import logging
-import wordcloud
-import numpy as np
+import multiprocessing
 from pathlib import Path
-from matplotlib import colors
-from win32com import client as winc
-from typing import Set, List, Optional, Union, Callable
+from typing import Set, List, Optional, Union, Callable, Iterable, Tuple
 
 import novela.constants as constants
-
-
-# 初始化结巴分词
-jieba.initialize()
-
-
-def get_wordcloud(font_path: str,  width: int = 400, height: int = 200, mask: Optional[np.ndarray] = None,
+from novela._utils.imports import LazyModule
+from novela.utils.docx_utils import read_docx
+from novela.utils.segment_cache import cached_cut
+
+
+# 以下模块只有分词、生成词云以及转换doc文件时才会用到，并且导入比较耗时（win32com只能在windows下导入），
+# 所以延迟到第一次使用时再导入；结巴分词的词典也在第一次分词时才加载
+jieba = LazyModule("jieba", global_dict=globals())
+np = LazyModule("numpy", global_dict=globals())
+wordcloud = LazyModule("wordcloud", global_dict=globals())
+colors = LazyModule("matplotlib.colors", global_dict=globals())
+winc = LazyModule("win32com.client", global_dict=globals())
+
+# CJK Unicode block中的中文字符范围
+# https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
+_CJK_RANGES = ((0x4E00, 0x9FFF), (0x3400, 0x4DBF), (0x20000, 0x2A6DF), (0x2A700, 0x2B73F),
+               (0x2B740, 0x2B81F), (0x2B820, 0x2CEAF), (0xF900, 0xFAFF), (0x2F800, 0x2FA1F))
+_CJK_CHARS = "".join("{}-{}".format(chr(start), chr(end)) for start, end in _CJK_RANGES)
+_CHINESE_CHAR_PATTERN = re.compile("[{}]".format(_CJK_CHARS))
+# 全角转半角：全角空格直接转换，其它全角字符根据对应的关系转换
+_Q2B_TABLE = {12288: 32}
+_Q2B_TABLE.update({code: code - 65248 for code in range(65281, 65375)})
+# 中文常用标点
+_CHINESE_PUNCS = frozenset([0xb7, 0xd7, 0x2014, 0x2018, 0x2019, 0x201c,
+                            0x201d, 0x2026, 0x3001, 0x3002, 0x300a, 0x300b,
+                            0x300e, 0x300f, 0x3010, 0x3011, 0xff01, 0xff08,
+                            0xff09, 0xff0c, 0xff1a, 0xff1b, 0xff1f])
+# 空白字符：如果前面是英文字母或者英文标点，后面是英文字母，则只保留最后一个空白字符，否则全部去除
+_SPACE_PATTERN = re.compile(r"(?<=[A-Za-z{}])\s*(\s)(?=[A-Za-z])|\s+".format(re.escape(string.punctuation)))
+# clean_text中需要去除的字符：除了中文、中文标点、英文字母、英文标点、数字以及空白字符以外的所有字符
+_INVALID_CHAR_PATTERN = re.compile(r"[^{}{}A-Za-z0-9{}\s]".format(
+    _CJK_CHARS, "".join(map(chr, sorted(_CHINESE_PUNCS))), re.escape(string.punctuation)))
+
+
+def get_wordcloud(font_path: str,  width: int = 400, height: int = 200, mask: Optional["np.ndarray"] = None,
                   scale: float = 1.0, min_font_size: int = 4, max_font_size: int = None, max_words: int = 200,
                   min_word_length: int = 0, stopwords: Optional[Set[str]] = None, mode: str = "RGB",
                   relative_scaling: Union[float, str] = "auto", color_func: Optional[Callable] = None,
                   regexp: Optional[str] = None, collocations: bool = True, collocation_threshold: int = 30,
-                  colormap: Union[str, colors.ListedColormap] = "viridis", normalize_plurals: bool = True,
+                  colormap: Union[str, "colors.ListedColormap"] = "viridis", normalize_plurals: bool = True,
                   repeat: bool = False, include_numbers: bool = False,
                   contour_width: float = 0.0, contour_color: str = "black",
                   background_color: str = "white"):
@@ -79,11 +102,9 @@ def get_sentences(file: str) -> List[str]:
     """
     sentences = []
     if file.endswith(".docx"):
-        document = docx.Document(file)
-        for para in document.paragraphs:
-            text = para.text.strip()
-            if has_chinese(text):
-                sentences.append(text)
+        document = read_docx(file)
+        texts = [para.text.strip() for para in document.paragraphs]
+        sentences = [text for text, flag in zip(texts, has_chinese_batch(texts)) if flag]
     else:
         para = ""  # 用于记录段落
         with open(file, "r", encoding="utf-8") as f:
@@ -102,37 +123,87 @@ def get_sentences(file: str) -> List[str]:
     return sentences
 
 
-def get_wordlist(sentences: List[str], stopwords: Set[str] = set()) -> List[str]:
+def get_wordlist(sentences: List[str], stopwords: Set[str] = set(), num_workers: int = 1) -> List[str]:
     """
     将多个语句组成的列表转化为单词列表
     :param sentences: List[str]，每一个元素表示一个语句或者一个段落
     :param stopwords: Set[str]，表示停用词词表
+    :param num_workers: int型，分词使用的进程数量，语句较多时可以使用多进程分词
     :return:
     """
-    wordlist = []
-    for sent in sentences:
-        for word in jieba.cut(sent):
-            word = word.strip()
-            if word and has_chinese(word) and word not in stopwords and len(word) > 1:
-                wordlist.append(word)
-    return wordlist
+    sent_words = cut_sentences(sentences, stopwords, num_workers=num_workers, chinese_words_only=True)
+    return [word for words in sent_words for word in words]
+
+
+def _filter_words(words: Iterable[str], stopwords: Optional[Set[str]], chinese_words_only: bool) -> List[str]:
+    """
+    过滤分词结果
+    :param chinese_words_only: bool型，为True时只保留包含中文、长度大于1且不是停用词的单词（去除前后空格），
+                               为False时只去除停用词
+    """
+    if chinese_words_only:
+        search = _CHINESE_CHAR_PATTERN.search
+        stopwords = stopwords or ()
+        # 先做开销小的判断
+        return [word for word in (w.strip() for w in words)
+                if len(word) > 1 and word not in stopwords and search(word) is not None]
+    if stopwords is None:
+        return list(words)
+    return [word for word in words if word not in stopwords]
+
+
+# 多进程分词时子进程使用的停用词以及过滤方式，在fork之前由父进程设置，子进程以写时复制的方式共享
+_SEGMENT_WORKER_ARGS: Optional[Tuple[Optional[Set[str]], bool]] = None
+
+
+def _cut_sentences_chunk(sentences: List[str]) -> List[List[str]]:
+    """子进程中对一组语句分词并过滤"""
+    stopwords, chinese_words_only = _SEGMENT_WORKER_ARGS
+    return [_filter_words(jieba.cut(sent), stopwords, chinese_words_only) for sent in sentences]
+
+
+def cut_sentences(sentences: List[str],
+                  stopwords: Optional[Set[str]] = None,
+                  num_workers: int = 1,
+                  chunk_size: int = 500,
+                  chinese_words_only: bool = False) -> List[List[str]]:
+    """
+    批量分词，按照语句的顺序返回每个语句的分词结果，停用词在分词的进程中直接去除
+    当num_workers大于1时，将语句按照chunk_size分组后交给多个进程分词（子进程中不使用分词缓存），
+    否则在当前进程中使用分词缓存分词
+    :param sentences: List[str]型，需要分词的语句
+    :param stopwords: Set[str]型（可选），停用词词表，为None时不去除停用词
+    :param num_workers: int型，进程的数量
+    :param chunk_size: int型，每个进程每次处理的语句数量
+    :param chinese_words_only: bool型，是否只保留包含中文且长度大于1的单词（与get_wordlist一致）
+    :return: List[List[str]]，与sentences一一对应
+    """
+    if num_workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        logging.getLogger(constants.PACKAGE_NAME).warning("当前平台不支持fork方式创建进程，改为使用单进程分词")
+        num_workers = 1
+    chunks = [sentences[i: i + chunk_size] for i in range(0, len(sentences), chunk_size)]
+    if num_workers <= 1 or len(chunks) <= 1:
+        return [_filter_words(cached_cut(sent), stopwords, chinese_words_only) for sent in sentences]
+
+    global _SEGMENT_WORKER_ARGS
+    _SEGMENT_WORKER_ARGS = (stopwords, chinese_words_only)
+    # 在fork之前加载好词典，避免每个子进程各自加载
+    jieba.initialize()
+    try:
+        with multiprocessing.get_context("fork").Pool(processes=min(num_workers, len(chunks))) as pool:
+            result = []
+            for chunk_words in pool.imap(_cut_sentences_chunk, chunks):
+                result.extend(chunk_words)
+    finally:
+        _SEGMENT_WORKER_ARGS = None
+    return result
 
 
 def is_chinese_char(ch: str) -> bool:
     """Checks whether CP is the codepoint of a CJK character."""
     # This defines a "chinese character" as anything in the CJK Unicode block:
     #   https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
-    cp = ord(ch)
-    if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
-        (cp >= 0x3400 and cp <= 0x4DBF) or  #
-        (cp >= 0x20000 and cp <= 0x2A6DF) or  #
-        (cp >= 0x2A700 and cp <= 0x2B73F) or  #
-        (cp >= 0x2B740 and cp <= 0x2B81F) or  #
-        (cp >= 0x2B820 and cp <= 0x2CEAF) or
-        (cp >= 0xF900 and cp <= 0xFAFF) or  #
-        (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
-        return True
-    return False
+    return _CHINESE_CHAR_PATTERN.fullmatch(ch) is not None
 
 
 def is_english_char(ch: str) -> bool:
@@ -149,57 +220,31 @@ def strQ2B(ustring: str) -> str:
     :param ustring:
     :return:
     """
-    rstring = ""
-    for uchar in ustring:
-        inside_code = ord(uchar)
-        # 全角空格直接转换
-        if inside_code == 12288:
-            inside_code = 32
-        # 全角字符（除空格）根据对应的关系转换
-        elif (inside_code >= 65281 and inside_code <= 65374):
-            inside_code -= 65248
-        rstring += chr(inside_code)
-    return rstring
+    return ustring.translate(_Q2B_TABLE)
+
+
+def strQ2B_batch(ustrings: List[str]) -> List[str]:
+    """
+    批量将全角符号转为对应的半角符号
+    :param ustrings: List[str]型
+    :return:
+    """
+    return [ustring.translate(_Q2B_TABLE) for ustring in ustrings]
 
 
 def is_chinese_punc(ch: str) -> bool:
     # 关于中文常用标点unicode编码 http://blog.chinaunix.net/uid-12348673-id-3335307.html
-    puncs = [0xb7, 0xd7, 0x2014, 0x2018, 0x2019, 0x201c,
-            0x201d, 0x2026, 0x3001, 0x3002, 0x300a, 0x300b,
-            0x300e, 0x300f, 0x3010, 0x3011, 0xff01, 0xff08,
-            0xff09, 0xff0c, 0xff1a, 0xff1b, 0xff1f]
-    if ord(ch) in puncs:
-        return True
-    return False
+    return ord(ch) in _CHINESE_PUNCS
 
 
 def remove_space(ustring: str) -> str:
     """
     移除中文前后以及中间的空格，但是保留英文单词之间的空格
+    （连续的空白字符前面是英文字母或者英文标点，后面是英文字母时，保留最后一个空白字符，否则全部去除）
     :param ustring: str型
     :return:
     """
-    ustring = ustring.strip()
-    rstring = ""
-    pre_ch = ""    # 保留空格位置前面第一个不为空格的字符
-
-    s_len = len(ustring)
-    for i in range(s_len):
-        ch = ustring[i]
-        if i == 0 or i == s_len - 1:
-            rstring += ch
-            pre_ch = ch
-        else:
-            # 如果当前字符不为空格
-            if ch.strip():
-                rstring += ch
-                pre_ch = ch
-            else:
-                # 如果空格字符的前面和后面都是英文，则保留；
-                # 否则去除该空格
-                if (is_english_char(pre_ch) or pre_ch in string.punctuation) and (is_english_char(ustring[i+1])):
-                    rstring += ch
-    return rstring
+    return _SPACE_PATTERN.sub(r"\1", ustring.strip())
 
 
 def clean_text(ustring: str) -> str:
@@ -209,15 +254,19 @@ def clean_text(ustring: str) -> str:
     :return:
     """
     # ustring = strQ2B(ustring)   # 这里将中文标点符号转化为英文标点，这里不需要
-    # 移除一些无用的空格
-    ustring = remove_space(ustring)
-    rstring = ""
-    for ch in ustring:
-        if (is_chinese_char(ch) or is_chinese_punc(ch)) or \
-                (is_english_char(ch) or (ch in string.punctuation)) \
-                or (ch in string.digits) or (ch.isspace()):
-            rstring += ch
-    return rstring
+    # 移除一些无用的空格，再去掉其它的字符
+    return _INVALID_CHAR_PATTERN.sub("", remove_space(ustring))
+
+
+def clean_texts(ustrings: List[str]) -> List[str]:
+    """
+    批量清洗文本，结果与逐个调用clean_text一致
+    :param ustrings: List[str]型，表示原始字符串列表
+    :return:
+    """
+    space_sub = _SPACE_PATTERN.sub
+    invalid_sub = _INVALID_CHAR_PATTERN.sub
+    return [invalid_sub("", space_sub(r"\1", ustring.strip())) for ustring in ustrings]
 
 
 def has_chinese(string: str) -> bool:
@@ -226,10 +275,17 @@ def has_chinese(string: str) -> bool:
     :param string:
     :return:
     """
-    for ch in string:
-        if is_chinese_char(ch):
-            return True
-    return False
+    return _CHINESE_CHAR_PATTERN.search(string) is not None
+
+
+def has_chinese_batch(strings: List[str]) -> List[bool]:
+    """
+    批量判断字符串中是否包含中文字符
+    :param strings: List[str]型
+    :return: List[bool]，与strings一一对应
+    """
+    search = _CHINESE_CHAR_PATTERN.search
+    return [search(string) is not None for string in strings]
 
 
 def load_stopwords(file: str, extra_words: List[str] = None) -> Set[str]:
@@ -283,7 +339,7 @@ def sort_file(file_list: List[str]) -> List[str]:
     for i, file in enumerate(file_list):
         match = re.search(pattern, file)
         if match is None:
-            indexes.append((i, float(np.inf)))
+            indexes.append((i, float("inf")))
         else:
             indexes.append((i, float(match.group(0))))
 
@@ -0,0 +1,183 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-08
+"""
+流式读取docx文档：只遍历一次`word/document.xml`，得到正文的段落以及表格，
+接口（paragraphs / tables / rows / cells / text）与python-docx保持一致，
+但是每个表格的单元格只解析一次，避免python-docx中`row.cells`每次都重新解析整个表格的合并单元格
+"""
+import zipfile
+from typing import List, Tuple, Union, Optional, IO
+
+from novela._utils.imports import LazyModule
+
+
+# 只有读取docx文件时才导入
+etree = LazyModule("lxml.etree", global_dict=globals())
+
+
+_W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def _qn(tag: str) -> str:
+    return "{%s}%s" % (_W_NS, tag)
+
+
+_W_BODY = _qn("body")
+_W_P = _qn("p")
+_W_R = _qn("r")
+_W_T = _qn("t")
+_W_TAB = _qn("tab")
+_W_BR = _qn("br")
+_W_CR = _qn("cr")
+_W_TBL = _qn("tbl")
+_W_TBL_GRID = _qn("tblGrid")
+_W_GRID_COL = _qn("gridCol")
+_W_TR = _qn("tr")
+_W_TC = _qn("tc")
+_W_TC_PR = _qn("tcPr")
+_W_GRID_SPAN = _qn("gridSpan")
+_W_V_MERGE = _qn("vMerge")
+_W_VAL = _qn("val")
+
+
+class DocxParagraph:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class DocxCell:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class DocxRow:
+    __slots__ = ("cells",)
+
+    def __init__(self, cells: Tuple[DocxCell, ...]):
+        self.cells = cells
+
+
+class DocxTable:
+    __slots__ = ("rows",)
+
+    def __init__(self, rows: List[DocxRow]):
+        self.rows = rows
+
+
+class DocxDocument:
+    __slots__ = ("paragraphs", "tables")
+
+    def __init__(self, paragraphs: List[DocxParagraph], tables: List[DocxTable]):
+        self.paragraphs = paragraphs
+        self.tables = tables
+
+
+def _paragraph_text(p) -> str:
+    """段落的文本，与python-docx的`Paragraph.text`一致（只包括段落下直接的run）"""
+    text = ""
+    for r in p.iterchildren(_W_R):
+        for child in r:
+            tag = child.tag
+            if tag == _W_T:
+                text += child.text or ""
+            elif tag == _W_TAB:
+                text += "\t"
+            elif tag == _W_BR or tag == _W_CR:
+                text += "\n"
+    return text
+
+
+def _cell_merge(tc) -> Tuple[int, Optional[str]]:
+    """单元格横向合并的列数（gridSpan）以及纵向合并的类型（vMerge）"""
+    grid_span, v_merge = 1, None
+    tc_pr = tc.find(_W_TC_PR)
+    if tc_pr is not None:
+        span = tc_pr.find(_W_GRID_SPAN)
+        if span is not None:
+            grid_span = int(span.get(_W_VAL))
+        merge = tc_pr.find(_W_V_MERGE)
+        if merge is not None:
+            v_merge = merge.get(_W_VAL, "continue")
+    return grid_span, v_merge
+
+
+def _parse_table(tbl) -> DocxTable:
+    """
+    解析表格，合并单元格的处理方式与python-docx一致：
+    横向合并（gridSpan）的单元格在每一列都重复出现，纵向合并（vMerge=continue）的单元格取上一行同一列的单元格
+    """
+    grid = tbl.find(_W_TBL_GRID)
+    col_count = len(grid.findall(_W_GRID_COL)) if grid is not None else 0
+    # 没有tblGrid时，以单元格（包括横向合并）最多的一行作为列数，单元格不足的行用空的单元格补齐
+    pad_rows = col_count == 0
+    if pad_rows:
+        col_count = max((sum(_cell_merge(tc)[0] for tc in tr.iterchildren(_W_TC))
+                         for tr in tbl.iterchildren(_W_TR)), default=0)
+
+    cells = []
+    row_count = 0
+    for tr in tbl.iterchildren(_W_TR):
+        row_count += 1
+        for tc in tr.iterchildren(_W_TC):
+            grid_span, v_merge = _cell_merge(tc)
+            for span_idx in range(grid_span):
+                if v_merge == "continue" and len(cells) >= col_count:
+                    cells.append(cells[-col_count])
+                elif span_idx > 0:
+                    cells.append(cells[-1])
+                else:
+                    cell_text = "\n".join(_paragraph_text(p) for p in tc.iterchildren(_W_P))
+                    cells.append(DocxCell(cell_text))
+        if pad_rows:
+            cells.extend(DocxCell("") for _ in range(row_count * col_count - len(cells)))
+
+    # 与python-docx一样，按照表格的列数对单元格进行切分
+    rows = [DocxRow(tuple(cells[i * col_count: (i + 1) * col_count])) for i in range(row_count)]
+    return DocxTable(rows)
+
+
+def read_docx(file: Union[str, IO[bytes]]) -> DocxDocument:
+    """
+    流式读取docx文档中正文的段落和表格（不包括表格中嵌套的段落和表格）
+    :param file: str型或者二进制文件对象，表示docx文件
+    :return: DocxDocument对象，包括paragraphs和tables两个属性
+    """
+    paragraphs, tables = [], []
+    with zipfile.ZipFile(file) as zf:
+        with zf.open("word/document.xml") as f:
+            depth, body_depth = 0, -1
+            for event, elem in etree.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if elem.tag == _W_BODY:
+                        body_depth = depth
+                    continue
+                # 只处理正文下直接的段落和表格，处理完之后释放内存
+                if depth == body_depth + 1:
+                    if elem.tag == _W_P:
+                        paragraphs.append(DocxParagraph(_paragraph_text(elem)))
+                    elif elem.tag == _W_TBL:
+                        tables.append(_parse_table(elem))
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+                depth -= 1
+    return DocxDocument(paragraphs, tables)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    start = time.time()
+    doc = read_docx(sys.argv[1])
+    print("paragraphs: {}, tables: {}, time: {:.4f}s".format(len(doc.paragraphs), len(doc.tables),
+                                                             time.time() - start))
+    for table in doc.tables:
+        for row in table.rows:
+            print([cell.text for cell in row.cells])
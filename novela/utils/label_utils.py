@@ -2,32 +2,56 @@
 # @Author: 莫冉
 # @Date: 2021-02-16
 import os
-import jieba
+import time
+import uuid
 import numpy as np
-from typing import Set, List, Optional, Tuple, Dict, Any
+from functools import lru_cache
+from typing import Set, List, Optional, Tuple, Dict, Any, Union
 
 from openpyxl import load_workbook, Workbook
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.worksheet.merge import MergedCellRange
-from openpyxl.cell.cell import Cell
+from openpyxl.cell.cell import Cell, WriteOnlyCell
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, NamedStyle
 from openpyxl.styles import Side, Border, Alignment, PatternFill
 
-from novela import logger
+from novela import logger, ENUM_NAMES
+from novela._utils.imports import LazyModule
 from novela.label import BaseLabel, Label
+from novela.utils.common import cut_sentences
+from novela.utils.segment_cache import cached_cut
 from novela.text import WordVectorSimilarity, HowNetSimilarity, CilinSimilarity, SentVectorSimilarity
+from novela.text import DocumentFeatures
+from novela.text.sim_word2vec import masked_cosine_sim
+
+# 只有导出列式存储的标签数据集时才导入，pyarrow是可选的依赖（只有parquet格式需要）
+pd = LazyModule("pandas", global_dict=globals())
+pyarrow = LazyModule("pyarrow", global_dict=globals())
+parquet = LazyModule("pyarrow.parquet", global_dict=globals())
 
 
 def cut_and_remove_stopwords(sentence: str, stopwords: Set[str]):
     """对句子分词并去除停用词"""
     if stopwords is not None:
-        result = [word for word in jieba.cut(sentence) if word not in stopwords]
+        result = [word for word in cached_cut(sentence) if word not in stopwords]
     else:
-        result = jieba.lcut(sentence)
+        result = cached_cut(sentence)
     return result
 
 
+def batch_cut_and_remove_stopwords(sentences: List[str],
+                                   stopwords: Optional[Set[str]],
+                                   num_workers: int = 1,
+                                   chunk_size: int = 500) -> List[List[str]]:
+    """
+    对多个句子分词并去除停用词，结果与逐个调用cut_and_remove_stopwords一致
+    :param num_workers: int型，分词使用的进程数量，大于1时在多个进程中分词并去除停用词
+    :param chunk_size: int型，每个进程每次处理的句子数量
+    """
+    return cut_sentences(sentences, stopwords, num_workers=num_workers, chunk_size=chunk_size)
+
+
 def get_mean_sim(sim_matrix: np.ndarray, masks: np.ndarray):
     """得到每一个标签对于单词表的平均相似度"""
     sim_sum = np.sum(sim_matrix, axis=1)    # 得到每一个标签对于词表中所有单词相似度的和
@@ -42,65 +66,31 @@ def get_max_sim(sim_matrix: np.ndarray, masks: np.ndarray = None):
     return sim_max
 
 
-def similarity_between_base_label_and_sents(sent_words: List[str],
-                                            sent_strings: List[str],
-                                            base_label: BaseLabel,
-                                            sim_word2vector: WordVectorSimilarity,
-                                            sim_hownet: HowNetSimilarity,
-                                            sim_cilin: CilinSimilarity,
-                                            sim_sent2vector: SentVectorSimilarity,
-                                            return_counts: int = 1):
-    """计算baselabel中的标签以及各个标签描述和文本之间的相似度"""
-    # 这个表示所有枚举类的英文名
-    base_enum_names = base_label.enum_names
-    # ---- 首先获取当前base_label标签中所有标签对应的单词名称 -------
-    base_label_names = base_label.display_names
-    if len(base_enum_names) <= 0:
-        return None, None
-    # 所有的相似度都已经归一化到0-1之间了
-    # sim 的维度为 [label_num, words_num]
-    # mask的维度为 [label_num, words_num]，1表示是有效值，0表示无效值
-    # 计算word2vector相似度
-    w2v_sim, w2v_mask = sim_word2vector.wordlist_sim(base_label_names,
-                                                     sent_words)
-    # # 计算cilin相似度
-    # cilin_sim, cilin_mask = sim_cilin.wordlist_sim(base_label_names,
-    #                                                sent_words)
-    # 计算hownet相似度
-    # hownet_sim, hownet_mask = sim_hownet.wordlist_sim(base_label_names,
-    #                                                   sent_words)
-    # 得到每一种单词相似度的均值和最大值
-    w2v_sim_mean = get_mean_sim(w2v_sim, w2v_mask)
-    w2v_sim_max = get_max_sim(w2v_sim, w2v_mask)
-    # cilin_sim_mean = get_mean_sim(cilin_sim, cilin_mask)
-    # cilin_sim_max = get_max_sim(cilin_sim, cilin_mask)
-    # hownet_sim_mean = get_mean_sim(hownet_sim, hownet_mask)
-    # hownet_sim_max = get_max_sim(hownet_sim, hownet_mask)
-
-    word_sim_mean = w2v_sim_mean
-    word_sim_max = w2v_sim_max
-    word_sim = (word_sim_mean + word_sim_max) / 2
-
-
-    # ---- 接着考虑该标签各个类别是否存在描述，计算描述和各个句子之间的相似度 ---------
-    base_label_descriptions = base_label.descriptions
-    if base_label_descriptions and len(base_label_descriptions) == len(base_label_names):
-        # 句子的相似度也已经归一化到0-1之间，形状为 [label_num, sentence_num]
-        s2v_sim, s2v_mask = sim_sent2vector.sentlist_sim(base_label_descriptions,
-                                                         sent_strings)
-        s2v_sim_mean = get_mean_sim(s2v_sim, s2v_mask)
-        s2v_sim_max = get_max_sim(s2v_sim, s2v_mask)
-        sent_sim = (s2v_sim_mean + s2v_sim_max) / 2
-    else:
-        sent_sim = None
-
-    # --- 计算出所有相似度之后进行融合 ---
-    if sent_sim is None:
-        sim = word_sim
-    else:
-        sim = (word_sim + sent_sim) / 2
-
-    # 得到最大相似度的索引以及对应的标签
+def precompute_label_embeddings(sim_word2vector: WordVectorSimilarity,
+                                sim_sent2vector: SentVectorSimilarity,
+                                enum_names: Optional[List[str]] = None):
+    """
+    预先计算所有枚举类标签名称的词向量矩阵以及标签描述的句向量矩阵，
+    之后similarity_between_base_label_and_sents会直接使用缓存的结果
+    :param enum_names: List[str]型（可选），需要预先计算的枚举类类名，默认为所有的枚举类
+    """
+    if enum_names is None:
+        enum_names = ENUM_NAMES
+    for enum_name in enum_names:
+        base_label = BaseLabel(enum_name)
+        if len(base_label.enum_names) <= 0:
+            continue
+        sim_word2vector.get_label_matrix_and_mask(base_label.display_names)
+        if base_label.descriptions and len(base_label.descriptions) == len(base_label.display_names):
+            sim_sent2vector.get_label_matrix_and_mask(base_label.descriptions)
+    logger.info(f"预先计算了{len(enum_names)}个枚举类的标签向量。")
+
+
+def _get_top_labels(sim: np.ndarray,
+                    base_label_names: List[str],
+                    base_enum_names: List[str],
+                    return_counts: int = 1):
+    """根据每个标签的相似度得到相似度最大的标签"""
     if return_counts == 1:
         max_index = np.argmax(sim)
         value = base_label_names[max_index]
@@ -116,6 +106,131 @@ def similarity_between_base_label_and_sents(sent_words: List[str],
         raise ValueError(f"`return_count` must be greater equal than 1, but get `{return_counts}`.")
 
 
+def similarity_between_base_labels_and_sents(sent_words: List[str],
+                                             sent_strings: List[str],
+                                             base_labels: List[BaseLabel],
+                                             sim_word2vector: WordVectorSimilarity,
+                                             sim_hownet: HowNetSimilarity,
+                                             sim_cilin: CilinSimilarity,
+                                             sim_sent2vector: SentVectorSimilarity,
+                                             return_counts: Union[int, List[int]] = 1,
+                                             use_hownet: bool = False,
+                                             use_cilin: bool = False,
+                                             features: Optional[DocumentFeatures] = None) -> List[Tuple[Any, Any]]:
+    """
+    批量计算多个baselabel中的标签以及各个标签描述和文本之间的相似度，
+    文本只需要计算一次词向量，所有标签组拼接成一个矩阵后和文本只做一次矩阵乘法
+    :param base_labels: List[BaseLabel]型，需要分类的所有标签
+    :param return_counts: int型或者List[int]型，每个标签需要返回的类别数
+    :param use_hownet: bool型，是否同时使用HowNet计算单词相似度（和词向量的相似度取平均）
+    :param use_cilin: bool型，是否同时使用词林计算单词相似度（和词向量的相似度取平均）
+    :param features: DocumentFeatures型（可选），文档已经计算好的特征，此时忽略sent_words和sent_strings
+    :return: 与base_labels一一对应的(enum_name, value)，没有类别的标签返回(None, None)
+    """
+    if isinstance(return_counts, int):
+        return_counts = [return_counts] * len(base_labels)
+    results: List[Tuple[Any, Any]] = [(None, None)] * len(base_labels)
+    # 只保留存在类别的标签
+    valid = [i for i, base_label in enumerate(base_labels) if len(base_label.enum_names) > 0]
+    if not valid:
+        return results
+    if features is None:
+        features = DocumentFeatures(sent_words, sent_strings, sim_word2vector, sim_sent2vector)
+    sent_words = features.sent_words
+
+    # 每一组标签在拼接后的矩阵中对应的行 [start, end)
+    offsets = np.cumsum([0] + [len(base_labels[i].display_names) for i in valid])
+    all_label_names = [name for i in valid for name in base_labels[i].display_names]
+
+    # 所有的相似度都已经归一化到0-1之间了
+    # sim 的维度为 [all_label_num, words_num]
+    # mask的维度为 [all_label_num, words_num]，1表示是有效值，0表示无效值
+    # 计算word2vector相似度，标签一侧使用缓存的矩阵
+    label_blocks = [sim_word2vector.get_label_matrix_and_mask(base_labels[i].display_names) for i in valid]
+    w2v_sim, w2v_mask = masked_cosine_sim(np.concatenate([block[0] for block in label_blocks]),
+                                          np.concatenate([block[1] for block in label_blocks]),
+                                          features.word_matrix, features.word_mask)
+    # 得到每一种单词相似度的均值和最大值
+    word_sim_means = [get_mean_sim(w2v_sim, w2v_mask)]
+    word_sim_maxes = [get_max_sim(w2v_sim, w2v_mask)]
+    if use_cilin:
+        # 计算cilin相似度，无效的位置相似度为-1，需要先乘以mask
+        cilin_sim, cilin_mask = sim_cilin.wordlist_sim(all_label_names,
+                                                       sent_words)
+        cilin_sim = cilin_sim * cilin_mask
+        word_sim_means.append(get_mean_sim(cilin_sim, cilin_mask))
+        word_sim_maxes.append(get_max_sim(cilin_sim, cilin_mask))
+    if use_hownet:
+        # 计算hownet相似度，无效的位置相似度为-1，需要先乘以mask
+        hownet_sim, hownet_mask = sim_hownet.wordlist_sim(all_label_names,
+                                                          sent_words)
+        hownet_sim = hownet_sim * hownet_mask
+        word_sim_means.append(get_mean_sim(hownet_sim, hownet_mask))
+        word_sim_maxes.append(get_max_sim(hownet_sim, hownet_mask))
+
+    word_sim_mean = np.mean(word_sim_means, axis=0)
+    word_sim_max = np.mean(word_sim_maxes, axis=0)
+    sim = (word_sim_mean + word_sim_max) / 2
+
+    # ---- 接着考虑各个标签类别是否存在描述，计算描述和各个句子之间的相似度 ---------
+    desc_groups = [k for k, i in enumerate(valid)
+                   if base_labels[i].descriptions
+                   and len(base_labels[i].descriptions) == len(base_labels[i].display_names)]
+    if desc_groups:
+        # 句子的相似度也已经归一化到0-1之间，形状为 [desc_label_num, sentence_num]
+        desc_blocks = [sim_sent2vector.get_label_matrix_and_mask(base_labels[valid[k]].descriptions)
+                       for k in desc_groups]
+        s2v_sim, s2v_mask = masked_cosine_sim(np.concatenate([block[0] for block in desc_blocks]),
+                                              np.concatenate([block[1] for block in desc_blocks]),
+                                              features.sent_matrix, features.sent_mask)
+        sent_sim = (get_mean_sim(s2v_sim, s2v_mask) + get_max_sim(s2v_sim, s2v_mask)) / 2
+        # --- 对存在描述的标签，融合单词相似度和句子相似度 ---
+        desc_start = 0
+        for k in desc_groups:
+            start, end = offsets[k], offsets[k + 1]
+            desc_end = desc_start + end - start
+            sim[start:end] = (sim[start:end] + sent_sim[desc_start:desc_end]) / 2
+            desc_start = desc_end
+
+    # 分段得到每一组标签中最大相似度的索引以及对应的标签
+    for k, i in enumerate(valid):
+        results[i] = _get_top_labels(sim[offsets[k]:offsets[k + 1]],
+                                     base_labels[i].display_names,
+                                     base_labels[i].enum_names,
+                                     return_counts=return_counts[i])
+    return results
+
+
+def similarity_between_base_label_and_sents(sent_words: List[str],
+                                            sent_strings: List[str],
+                                            base_label: BaseLabel,
+                                            sim_word2vector: WordVectorSimilarity,
+                                            sim_hownet: HowNetSimilarity,
+                                            sim_cilin: CilinSimilarity,
+                                            sim_sent2vector: SentVectorSimilarity,
+                                            return_counts: int = 1,
+                                            use_hownet: bool = False,
+                                            use_cilin: bool = False,
+                                            features: Optional[DocumentFeatures] = None):
+    """
+    计算baselabel中的标签以及各个标签描述和文本之间的相似度
+    :param use_hownet: bool型，是否同时使用HowNet计算单词相似度（和词向量的相似度取平均）
+    :param use_cilin: bool型，是否同时使用词林计算单词相似度（和词向量的相似度取平均）
+    :param features: DocumentFeatures型（可选），文档已经计算好的特征
+    """
+    return similarity_between_base_labels_and_sents(sent_words=sent_words,
+                                                    sent_strings=sent_strings,
+                                                    base_labels=[base_label],
+                                                    sim_word2vector=sim_word2vector,
+                                                    sim_hownet=sim_hownet,
+                                                    sim_cilin=sim_cilin,
+                                                    sim_sent2vector=sim_sent2vector,
+                                                    return_counts=return_counts,
+                                                    use_hownet=use_hownet,
+                                                    use_cilin=use_cilin,
+                                                    features=features)[0]
+
+
 # --------------------------------------------------------------------------
 
 
@@ -131,17 +246,56 @@ def _get_column_max_chars(column: Tuple[Cell, ...]):
     return max_col_chars
 
 
+# 字符数超过上限的列使用的宽度，不是整数，从而和根据字符数计算的宽度（整数）区分开
+_CAPPED_COLUMN_WIDTH = 100.5
+
+
 def _set_column_width(worksheet: Worksheet, col: int, max_col_chars: int, max_width: int = 100, add_width: int = 10):
     """
     设置某一列的单元格宽度
     """
     col_letter = get_column_letter(col)
     if max_col_chars > max_width:
-        worksheet.column_dimensions[col_letter].width = 100
+        worksheet.column_dimensions[col_letter].width = _CAPPED_COLUMN_WIDTH
     elif max_col_chars > 2:
         worksheet.column_dimensions[col_letter].width = max_col_chars + add_width
 
 
+def _get_saved_column_max_chars(worksheet: Worksheet, col: int, add_width: int = 10) -> Optional[int]:
+    """
+    根据已经保存的列宽还原某一列的最大字符数（_set_column_width的逆运算），不需要扫描整列
+    返回None表示该列的宽度已经达到上限
+    """
+    dimension = worksheet.column_dimensions.get(get_column_letter(col))
+    if dimension is None or dimension.width is None:
+        return 0
+    if dimension.width == _CAPPED_COLUMN_WIDTH:
+        return None
+    return max(0, int(dimension.width) - add_width)
+
+
+def _update_column_widths(worksheet: Worksheet,
+                          cells: List[Cell],
+                          max_width: int = 150,
+                          add_width: int = 10):
+    """
+    根据新写入的单元格增量地更新所在列的宽度，只有新单元格的字符数超过原来的最大字符数时才加宽
+    原来的最大字符数由已经保存的列宽还原，耗时只和新写入的单元格数量有关
+    """
+    new_max_chars: Dict[int, int] = {}
+    for cell in cells:
+        new_max_chars[cell.column] = max(new_max_chars.get(cell.column, 0), len(str(cell.value)))
+    for col, max_col_chars in sorted(new_max_chars.items()):
+        saved_max_chars = _get_saved_column_max_chars(worksheet, col, add_width=add_width)
+        if saved_max_chars is None or max_col_chars <= saved_max_chars:
+            continue
+        _set_column_width(worksheet,
+                          col=col,
+                          max_col_chars=max_col_chars,
+                          max_width=max_width,
+                          add_width=add_width)
+
+
 def _adjust_cell_height(worksheet: Worksheet,
                         fixed_height: int = 20,
                         active_row: Optional[int] = None):
@@ -298,8 +452,8 @@ def _add_new_record(worksheet: Worksheet,
     # 只保留列merged_cell
     filter_merged_cell_ranges = [merged_cell for merged_cell in merged_cell_ranges
                                  if merged_cell.min_row == merged_cell.max_row]
-    # 定义一个标识是否插入了新的列的标志位
-    add_new_column_flag = False
+    # 记录新增的表头单元格，之后只更新新增单元格的风格和列宽
+    new_header_cells: List[Cell] = []
     # 对于每一个大类（基本信息/画面信息/故事信息/角色信息/其他信息）
     for (header, info), merged_cell in zip(label_dict.items(), filter_merged_cell_ranges):
         # 获取当前merged_cell最小列和最大列的标号
@@ -309,7 +463,6 @@ def _add_new_record(worksheet: Worksheet,
         col_len = max_col - min_col + 1
         # 如果当前有多个信息，则需要插入列
         if info_len > col_len:
-            add_new_column_flag = True
             _move_merged_cells(merged_cells=filter_merged_cell_ranges,
                                cur_max_col=max_col,
                                offset=info_len - col_len)
@@ -331,19 +484,19 @@ def _add_new_record(worksheet: Worksheet,
             else:
                 worksheet.cell(2, column=cur_column).value = k
                 worksheet.cell(next_row, column=cur_column).value = v
-    # 调节行高和列宽
-    if add_new_column_flag:
-        _adjust_cell_width_and_height(worksheet,
-                                      max_width=150,
-                                      add_width=10,
-                                      fixed_height=20)
-        _set_cell_styles(worksheet)
-    else:
-        _adjust_cell_height(worksheet,
-                            fixed_height=20,
-                            active_row=next_row)
-        _set_cell_styles(worksheet,
-                         active_row=next_row)
+                new_header_cells.extend([worksheet.cell(1, column=cur_column),
+                                         worksheet.cell(2, column=cur_column)])
+    # 只调节新增行的行高，并设置新增行以及新增表头的风格
+    _adjust_cell_height(worksheet,
+                        fixed_height=20,
+                        active_row=next_row)
+    _set_cell_styles(worksheet,
+                     active_row=next_row)
+    for cell in new_header_cells:
+        cell.style = "header"
+    # 根据新增的单元格增量地调节列宽
+    new_cells = new_header_cells + [worksheet.cell(next_row, column=c) for c in range(3, worksheet.max_column + 1)]
+    _update_column_widths(worksheet, new_cells)
 
 
 def _new_table(worksheet: Worksheet,
@@ -381,45 +534,267 @@ def _new_table(worksheet: Worksheet,
     _set_cell_styles(worksheet)
 
 
-def save_as_excel(to_file: str, novel_name: str, label: Label):
-    """
-    将标签保存到excel文件中
-    :param to_file: str型，表示保存到的文件名
-    :param novel_name: str型，小说的名称
-    :param label: Label型，表示标签对象
-    :return:
-    """
+def _to_xlsx_file(to_file: str) -> str:
+    """保证文件的后缀为.xlsx"""
     if not to_file.endswith(".xlsx"):
         filename_list = to_file.split(".")
         filename_list[-1] = "xlsx"
         to_file = ".".join(filename_list)
+    return to_file
+
 
-    # 将当前的标签转化为dict型
-    label_dict = label.to_json()
+def _get_column_width(max_col_chars: int, max_width: int = 150, add_width: int = 10) -> Optional[float]:
+    """根据某一列的最大字符数得到列宽（和_set_column_width保持一致），返回None表示使用默认宽度"""
+    if max_col_chars > max_width:
+        return _CAPPED_COLUMN_WIDTH
+    elif max_col_chars > 2:
+        return max_col_chars + add_width
+    return None
+
+
+class ExcelLabelWriter:
+    def __init__(self, to_file: str):
+        """
+        缓存多个小说的标签，之后一次性写入excel文件，格式和save_as_excel相同（前两行为合并的表头）
+        如果文件不存在，则使用openpyxl的write-only模式流式写入；
+        如果文件已经存在，则只加载和保存一次文件，将所有的记录追加到表格中
+        :param to_file: str型，表示保存到的文件名
+        """
+        self.to_file = _to_xlsx_file(to_file)
+        self.records: List[Tuple[str, Dict[str, Dict[str, Any]]]] = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def add(self, novel_name: str, label: Label):
+        """添加一条记录"""
+        # 将当前的标签转化为dict型
+        self.records.append((novel_name, label.to_json()))
+
+    def flush(self):
+        """将缓存的所有记录写入excel文件"""
+        if not self.records:
+            return
+        if os.path.isfile(self.to_file):
+            self._append_to_existing()
+        else:
+            self._write_new()
+        self.records = []
 
-    # 如果存在该文件则打开
-    if os.path.isfile(to_file):
-        workbook = load_workbook(to_file)
+    def _append_to_existing(self):
+        """加载已经存在的文件，追加所有的记录后保存一次"""
+        workbook = load_workbook(self.to_file)
         # 获取当前第一个sheet作为活跃的sheet对象
         worksheet = workbook.active
         # 注册styles
         _register_styles(workbook)
-        if worksheet.max_row > 2:
-            _add_new_record(worksheet, label_dict)
-        else:
-            _new_table(worksheet, label_dict)
-
-    else:
-        # 创建一个excel对象
-        workbook = Workbook()
-        worksheet = workbook.active
+        for novel_name, label_dict in self.records:
+            if worksheet.max_row > 2:
+                _add_new_record(worksheet, label_dict)
+            else:
+                _new_table(worksheet, label_dict)
+            # 设置id，以及novel_name
+            max_row = worksheet.max_row
+            id_cell = worksheet.cell(row=max_row, column=1)
+            name_cell = worksheet.cell(row=max_row, column=2)
+            id_cell.value = (max_row - 2)
+            name_cell.value = novel_name
+            _update_column_widths(worksheet, [id_cell, name_cell])
+        # 保存文件
+        workbook.save(self.to_file)
+
+    def _get_schema(self) -> List[Tuple[str, List[str]]]:
+        """得到所有记录中每一个大类（第一层表头）以及对应的所有字段（第二层表头），保持出现的顺序"""
+        schema: Dict[str, Dict[str, None]] = {}
+        for _, label_dict in self.records:
+            for header, info in label_dict.items():
+                keys = schema.setdefault(header, {})
+                for k in info:
+                    keys.setdefault(k, None)
+        return [(header, list(keys)) for header, keys in schema.items() if keys]
+
+    def _write_new(self):
+        """使用write-only模式新建文件并写入所有的记录"""
+        schema = self._get_schema()
+        # 前两行表头的内容
+        first_header: List[Any] = ["ID", "作品名称"]
+        second_header: List[Any] = [None, None]
+        for header, keys in schema:
+            first_header.extend([header] + [None] * (len(keys) - 1))
+            second_header.extend(keys)
+        rows = [first_header, second_header]
+        for i, (novel_name, label_dict) in enumerate(self.records):
+            row = [i + 1, novel_name]
+            for header, keys in schema:
+                info = label_dict.get(header, {})
+                row.extend(info.get(k) for k in keys)
+            rows.append(row)
+
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
         # 注册styles
         _register_styles(workbook)
-        _new_table(worksheet, label_dict)
-
-    # 设置id，以及novel_name
-    max_row = worksheet.max_row
-    worksheet.cell(row=max_row, column=1).value = (max_row - 2)
-    worksheet.cell(row=max_row, column=2).value = novel_name
-    # 保存文件
-    workbook.save(to_file)
+        # write-only模式下列宽需要在写入数据之前设置
+        for col, column in enumerate(zip(*rows), start=1):
+            width = _get_column_width(max(len(str(value)) for value in column))
+            if width is not None:
+                worksheet.column_dimensions[get_column_letter(col)].width = width
+        # 合并第1列和第2列中的第1行和第2行，以及第1行中每一个大类对应的列
+        worksheet.merged_cells.add("A1:A2")
+        worksheet.merged_cells.add("B1:B2")
+        start_column = 3
+        for header, keys in schema:
+            end_column = start_column + len(keys) - 1
+            # 只有一个字段的大类不需要合并（单个单元格的合并区域会被Excel认为是损坏的文件）
+            if end_column > start_column:
+                worksheet.merged_cells.add(f"{get_column_letter(start_column)}1:{get_column_letter(end_column)}1")
+            start_column = end_column + 1
+
+        for r, row in enumerate(rows, start=1):
+            worksheet.row_dimensions[r].height = 20
+            style = "header" if r < 3 else "content"
+            cells = []
+            for value in row:
+                cell = WriteOnlyCell(worksheet, value=value)
+                cell.style = style
+                cells.append(cell)
+            worksheet.append(cells)
+        # 保存文件
+        workbook.save(self.to_file)
+
+
+def save_as_excel(to_file: str, novel_name: str, label: Label):
+    """
+    将标签保存到excel文件中
+    :param to_file: str型，表示保存到的文件名
+    :param novel_name: str型，小说的名称
+    :param label: Label型，表示标签对象
+    :return:
+    """
+    writer = ExcelLabelWriter(to_file)
+    writer.add(novel_name, label)
+    writer.flush()
+
+
+# --------------------------------------------------------------------------
+
+
+# 列式存储中大类和字段名之间的分隔符
+COLUMN_SEPARATOR = "/"
+
+
+@lru_cache(maxsize=1)
+def get_label_columns() -> Tuple[str, ...]:
+    """
+    得到列式存储中固定的列名，第一列为作品名称，其余各列为"大类/字段名"（和Label.to_json()的顺序一致）
+    """
+    columns = ["作品名称"]
+    for header, info in Label().to_json().items():
+        columns.extend(f"{header}{COLUMN_SEPARATOR}{k}" for k in info)
+    return tuple(columns)
+
+
+def flatten_label(novel_name: str, label: Label) -> Dict[str, Optional[str]]:
+    """将标签展开成固定列名的一行数据，所有的值都转化为str型（空值为None）"""
+    row: Dict[str, Optional[str]] = dict.fromkeys(get_label_columns())
+    row["作品名称"] = novel_name
+    for header, info in label.to_json().items():
+        for k, v in info.items():
+            column = f"{header}{COLUMN_SEPARATOR}{k}"
+            if column not in row:
+                logger.warning(f"列`{column}`不在固定的列名中，已经忽略。")
+                continue
+            row[column] = None if v is None else str(v)
+    return row
+
+
+class ColumnarLabelWriter:
+    def __init__(self,
+                 to_dir: str,
+                 file_format: str = "parquet",
+                 row_group_size: int = 10000):
+        """
+        将标签展开成固定的列之后追加写入列式存储的文件（parquet或者csv），便于下游的分析任务读取
+        to_dir是一个数据集目录，每次写入都会新建part文件，不会修改已有的文件：
+            - parquet：每个writer对应一个part文件，每flush一次写入一个row group；
+            - csv：每flush一次写入一个part文件（包含表头）。
+        读取时直接读取整个目录即可，例如pandas.read_parquet(to_dir)
+        :param to_dir: str型，数据集目录
+        :param file_format: str型，"parquet"或者"csv"
+        :param row_group_size: int型，缓存的行数达到该值时自动写入一个row group（或者csv分块）
+        """
+        if file_format not in ("parquet", "csv"):
+            raise ValueError(f"`file_format` must be `parquet` or `csv`, but get `{file_format}`.")
+        if file_format == "parquet":
+            try:
+                parquet.ParquetWriter
+            except ImportError:
+                raise ImportError("Writing parquet files requires `pyarrow`, please install it "
+                                  "(pip install -r requirements-optional.txt) or use `file_format=\"csv\"`.")
+        self.to_dir = to_dir
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.columns = list(get_label_columns())
+        self.rows: List[Dict[str, Optional[str]]] = []
+        # part文件名的前缀，保证多次写入之间不会重名
+        self._part_prefix = f"part-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self._part_index = 0
+        self._parquet_writer = None
+        if not os.path.isdir(to_dir):
+            os.makedirs(to_dir)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, novel_name: str, label: Label):
+        """添加一条记录，缓存的行数达到row_group_size时自动写入"""
+        self.rows.append(flatten_label(novel_name, label))
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """将缓存的记录写入一个row group（或者csv分块）"""
+        if not self.rows:
+            return
+        if self.file_format == "parquet":
+            self._write_parquet()
+        else:
+            self._write_csv()
+        self.rows = []
+
+    def close(self):
+        """写入剩余的记录并关闭文件"""
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def _write_parquet(self):
+        schema = pyarrow.schema([(column, pyarrow.string()) for column in self.columns])
+        table = pyarrow.Table.from_pydict({column: [row[column] for row in self.rows] for column in self.columns},
+                                          schema=schema)
+        if self._parquet_writer is None:
+            to_file = os.path.join(self.to_dir, f"{self._part_prefix}.parquet")
+            self._parquet_writer = parquet.ParquetWriter(to_file, schema)
+        self._parquet_writer.write_table(table, row_group_size=len(self.rows))
+
+    def _write_csv(self):
+        to_file = os.path.join(self.to_dir, f"{self._part_prefix}-{self._part_index:05d}.csv")
+        df = pd.DataFrame(self.rows, columns=self.columns)
+        # 先写入临时文件再重命名，防止读取到不完整的分块
+        tmp_file = to_file + ".tmp"
+        df.to_csv(tmp_file, index=False, encoding="utf-8")
+        os.replace(tmp_file, to_file)
+        self._part_index += 1
@@ -0,0 +1,182 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-09
+"""
+分词结果的缓存：以语句的哈希值作为键，保存jieba的分词结果（默认模式），
+所有需要分词的地方共用一个有容量上限的LRU缓存，并且可以保存到磁盘之后重新加载
+"""
+import os
+import gc
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import novela.constants as constants
+from novela._utils.imports import LazyModule
+
+
+# jieba的导入比较耗时，第一次分词时再导入
+jieba = LazyModule("jieba", global_dict=globals())
+
+
+logger = logging.getLogger(constants.PACKAGE_NAME).getChild("segment_cache")
+
+# 缓存文件的版本号，缓存中保存的内容发生变化时需要增加
+CACHE_VERSION = 1
+
+
+class SegmentCache:
+    def __init__(self, max_size: int = constants.SEGMENT_CACHE_SIZE, cache_file: Optional[str] = None):
+        """
+        分词结果的LRU缓存
+        :param max_size: int型，最多缓存的语句数量，超过之后淘汰最久没有使用的语句
+        :param cache_file: str型（可选），缓存文件的路径，如果文件存在则在构造时加载
+        """
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self._cache: "OrderedDict[bytes, Tuple[str, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if cache_file is not None and os.path.isfile(cache_file):
+            self.load(cache_file)
+
+    @staticmethod
+    def _hash(sentence: str) -> bytes:
+        return hashlib.blake2b(sentence.encode("utf-8"), digest_size=16).digest()
+
+    @staticmethod
+    def _cache_key() -> Dict[str, object]:
+        """
+        缓存文件的键，分词词典发生变化时缓存失效：
+        包括词典文件的路径、修改时间和大小，以及用户词（add_word / load_userdict / del_word）修改之后词典的状态
+        """
+        # 词典在第一次分词时才加载，这里先加载，保证加载和保存缓存时比较的是同样的状态
+        jieba.dt.check_initialized()
+        dict_file = jieba.dt.dictionary or os.path.join(os.path.dirname(jieba.__file__), jieba.DEFAULT_DICT_NAME)
+        try:
+            dict_stat = os.stat(dict_file)
+            dict_file_key = (dict_stat.st_mtime_ns, dict_stat.st_size)
+        except OSError:
+            dict_file_key = None
+        return {"version": CACHE_VERSION,
+                "jieba": jieba.__version__,
+                "dictionary": jieba.dt.dictionary,
+                "dictionary_file": dict_file_key,
+                "num_words": len(jieba.dt.FREQ),
+                "total_freq": jieba.dt.total,
+                "force_split_words": len(jieba.finalseg.Force_Split_Words)}
+
+    def cut(self, sentence: str) -> List[str]:
+        """
+        对语句分词，结果与jieba.lcut(sentence)一致
+        :param sentence: str型
+        :return: List[str]，每次返回新的列表，调用者可以修改
+        """
+        key = self._hash(sentence)
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(tokens)
+            self.misses += 1
+
+        tokens = tuple(jieba.cut(sentence))
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return list(tokens)
+
+    def cut_many(self, sentences: List[str]) -> List[List[str]]:
+        """批量分词，按照语句的顺序返回结果"""
+        return [self.cut(sentence) for sentence in sentences]
+
+    def stats(self) -> Dict[str, float]:
+        """缓存的统计信息：命中次数、未命中次数、命中率、淘汰次数以及当前缓存的语句数量"""
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "evictions": self.evictions,
+                "size": len(self._cache),
+                "max_size": self.max_size}
+
+    def clear(self):
+        """清空缓存以及统计信息（例如修改了jieba的词典之后）"""
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def load(self, cache_file: Optional[str] = None) -> bool:
+        """
+        从磁盘加载缓存，加载的结果排在当前缓存的前面（最先被淘汰）
+        :param cache_file: str型（可选），缓存文件的路径，默认为构造时的cache_file
+        :return: bool型，是否加载成功
+        """
+        cache_file = cache_file or self.cache_file
+        if cache_file is None or not os.path.isfile(cache_file):
+            return False
+        gc_enabled = gc.isenabled()
+        try:
+            # 反序列化大量的小对象时暂停垃圾回收
+            gc.disable()
+            with open(cache_file, "rb") as f:
+                snapshot = pickle.load(f)
+            if snapshot.get("key") != self._cache_key():
+                logger.info("分词词典已经发生变化，不使用分词缓存。")
+                return False
+        except Exception as e:
+            logger.warning(f"加载分词缓存出错!@{e}")
+            return False
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        with self._lock:
+            entries = OrderedDict(snapshot["entries"])
+            entries.update(self._cache)
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+            self._cache = entries
+        logger.info(f"从{cache_file}加载{len(snapshot['entries'])}条分词缓存。")
+        return True
+
+    def save(self, cache_file: Optional[str] = None):
+        """
+        将缓存保存到磁盘
+        :param cache_file: str型（可选），缓存文件的路径，默认为构造时的cache_file
+        """
+        cache_file = cache_file or self.cache_file
+        if cache_file is None:
+            return
+        with self._lock:
+            snapshot = {"key": self._cache_key(), "entries": list(self._cache.items())}
+        try:
+            cache_dir = os.path.dirname(cache_file)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = cache_file + ".tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            logger.warning(f"保存分词缓存出错!@{e}")
+
+
+# 所有模块共用的分词缓存
+segment_cache = SegmentCache()
+
+
+def cached_cut(sentence: str) -> List[str]:
+    """使用共用的分词缓存对语句分词，结果与jieba.lcut(sentence)一致"""
+    return segment_cache.cut(sentence)
@@ -8,4 +8,6 @@ outline_app = OutlineApp()
 app.add_url_rule("/", view_func=outline_app.index)
 app.add_url_rule("/index", view_func=outline_app.index)
 app.add_url_rule("/init", view_func=outline_app.init_model, methods=["POST"])
-app.add_url_rule("/analysis", view_func=outline_app.analysis, methods=["POST"])
\ No newline at end of file
+app.add_url_rule("/analysis", view_func=outline_app.analysis, methods=["POST"])
+app.add_url_rule("/analysis/jobs", view_func=outline_app.submit_job, methods=["POST"])
+app.add_url_rule("/analysis/jobs/<job_id>", view_func=outline_app.job_status, methods=["GET"])
@@ -7,4 +7,10 @@ python run_process_outline.py \
   --file_name=$FILE \
   --w2v_file=$W2V_FILE \
   --to_dir=/home/results/novel \
-  --to_file=$TO_FILE
\ No newline at end of file
+  --to_file=$TO_FILE
+# 不指定--file_name时，批量处理--source_dir中的所有大纲文件（模型只加载一次）
+# python run_process_outline.py \
+#   --source_dir=/home/data/corpus \
+#   --w2v_file=$W2V_FILE \
+#   --to_dir=/home/results/novel \
+#   --to_file=$TO_FILE
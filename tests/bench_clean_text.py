@@ -0,0 +1,35 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-08
+"""
+对比正则表达式版本的clean_text / clean_texts与原来逐字符拼接版本的速度
+运行：python tests/bench_clean_text.py
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(__file__))
+
+import timeit
+
+from test_clean_text import TEXTS, legacy_clean_text
+from novela.utils.common import clean_text, clean_texts
+
+
+def main(repeat: int = 3):
+    assert clean_texts(TEXTS) == [legacy_clean_text(text) for text in TEXTS]
+
+    def best(func) -> float:
+        return min(timeit.repeat(func, number=1, repeat=repeat))
+
+    legacy_time = best(lambda: [legacy_clean_text(text) for text in TEXTS])
+    new_time = best(lambda: [clean_text(text) for text in TEXTS])
+    bulk_time = best(lambda: clean_texts(TEXTS))
+
+    print("{} 条文本，取{}次中最快的一次".format(len(TEXTS), repeat))
+    print("legacy clean_text: {:.4f}s".format(legacy_time))
+    print("clean_text:        {:.4f}s ({:.1f}x)".format(new_time, legacy_time / new_time))
+    print("clean_texts:       {:.4f}s ({:.1f}x)".format(bulk_time, legacy_time / bulk_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-08
+"""
+对比正则表达式/translate版本的has_chinese、is_chinese_char、strQ2B与原来逐字符循环版本的结果
+"""
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from novela.utils.common import has_chinese, has_chinese_batch, is_chinese_char, strQ2B, strQ2B_batch
+from text_samples import random_texts
+
+
+def legacy_is_chinese_char(ch: str) -> bool:
+    cp = ord(ch)
+    if ((cp >= 0x4E00 and cp <= 0x9FFF) or
+        (cp >= 0x3400 and cp <= 0x4DBF) or
+        (cp >= 0x20000 and cp <= 0x2A6DF) or
+        (cp >= 0x2A700 and cp <= 0x2B73F) or
+        (cp >= 0x2B740 and cp <= 0x2B81F) or
+        (cp >= 0x2B820 and cp <= 0x2CEAF) or
+        (cp >= 0xF900 and cp <= 0xFAFF) or
+        (cp >= 0x2F800 and cp <= 0x2FA1F)):
+        return True
+    return False
+
+
+def legacy_has_chinese(string: str) -> bool:
+    for ch in string:
+        if legacy_is_chinese_char(ch):
+            return True
+    return False
+
+
+def legacy_strQ2B(ustring: str) -> str:
+    rstring = ""
+    for uchar in ustring:
+        inside_code = ord(uchar)
+        if inside_code == 12288:
+            inside_code = 32
+        elif (inside_code >= 65281 and inside_code <= 65374):
+            inside_code -= 65248
+        rstring += chr(inside_code)
+    return rstring
+
+
+# 一半的文本只包含非中文字符
+NON_CHINESE = [chr(c) for c in range(0x20, 0x7f)] + [chr(c) for c in range(0xff00, 0xff70)] + ["　", "\U0002A6E0"]
+CHINESE = list("大纲故事梗概出场人物") + ["\U00020001", "\U0002A700", "豈", "\U0002F800"]
+TEXTS = random_texts(20000, [NON_CHINESE + CHINESE, NON_CHINESE])
+
+
+def test_is_chinese_char():
+    for code in range(0x30000):
+        ch = chr(code)
+        assert is_chinese_char(ch) == legacy_is_chinese_char(ch), hex(code)
+
+
+def test_has_chinese():
+    expected = [legacy_has_chinese(text) for text in TEXTS]
+    assert [has_chinese(text) for text in TEXTS] == expected
+    assert has_chinese_batch(TEXTS) == expected
+
+
+def test_strQ2B():
+    expected = [legacy_strQ2B(text) for text in TEXTS]
+    assert [strQ2B(text) for text in TEXTS] == expected
+    assert strQ2B_batch(TEXTS) == expected
@@ -0,0 +1,71 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-08
+"""
+对比正则表达式版本的clean_text / remove_space与原来逐字符拼接版本的结果
+"""
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import string
+
+from novela.utils.common import clean_text, clean_texts, remove_space
+from novela.utils.common import is_chinese_char, is_english_char, is_chinese_punc
+from text_samples import random_texts
+
+
+def legacy_remove_space(ustring: str) -> str:
+    """原来逐字符拼接的remove_space"""
+    ustring = ustring.strip()
+    rstring = ""
+    pre_ch = ""
+    s_len = len(ustring)
+    for i in range(s_len):
+        ch = ustring[i]
+        if i == 0 or i == s_len - 1:
+            rstring += ch
+            pre_ch = ch
+        else:
+            if ch.strip():
+                rstring += ch
+                pre_ch = ch
+            else:
+                if (is_english_char(pre_ch) or pre_ch in string.punctuation) and (is_english_char(ustring[i+1])):
+                    rstring += ch
+    return rstring
+
+
+def legacy_clean_text(ustring: str) -> str:
+    """原来逐字符拼接的clean_text"""
+    ustring = legacy_remove_space(ustring)
+    rstring = ""
+    for ch in ustring:
+        if (is_chinese_char(ch) or is_chinese_punc(ch)) or \
+                (is_english_char(ch) or (ch in string.punctuation)) \
+                or (ch in string.digits) or (ch.isspace()):
+            rstring += ch
+    return rstring
+
+
+# 包含中英文、标点、全角字符、各种空白字符以及生僻字
+ALPHABET = (list("大纲故事梗概出场人物主角身份性格，。：；！？、“”‘’《》【】（）…—·×")
+            + list(string.ascii_letters + string.digits + string.punctuation)
+            + list(" \t\n\r　\xa0 \x1c") * 3
+            + ["\U00020001", "\U0002A700", "豈", "①", "Ａ", "😀", "é"])
+TEXTS = random_texts(20000, [ALPHABET]) + ["  Hello   World  ", "作品 资料： 男频  ", "a, b", "a ,b", "Tom  和 Jerry",
+                                           "", "   ", "x"]
+
+
+def test_remove_space():
+    for text in TEXTS:
+        assert remove_space(text) == legacy_remove_space(text), repr(text)
+
+
+def test_clean_text():
+    for text in TEXTS:
+        assert clean_text(text) == legacy_clean_text(text), repr(text)
+
+
+def test_clean_texts():
+    assert clean_texts(TEXTS) == [legacy_clean_text(text) for text in TEXTS]
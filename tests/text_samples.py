@@ -0,0 +1,24 @@
+# coding=utf-8
+# @Author: 莫冉
+# @Date: 2021-03-08
+"""
+测试用的随机文本
+"""
+import random
+from typing import List
+
+
+def random_texts(num: int, alphabets: List[List[str]], max_len: int = 200, seed: int = 2021) -> List[str]:
+    """
+    生成随机文本，第i条文本的字符从alphabets[i % len(alphabets)]中选取
+    :param num: int型，文本的数量
+    :param alphabets: List[List[str]]型，每条文本可以使用的字符集合
+    :param max_len: int型，文本的最大长度
+    :param seed: int型，随机数种子，保证每次生成的文本相同
+    """
+    rng = random.Random(seed)
+    texts = []
+    for i in range(num):
+        alphabet = alphabets[i % len(alphabets)]
+        texts.append("".join(rng.choice(alphabet) for _ in range(rng.randint(0, max_len))))
+    return texts